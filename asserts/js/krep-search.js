@@ -0,0 +1,111 @@
+/*! krep search */
+(function () {
+  'use strict';
+
+  var LIMIT = 50;
+
+  function lowerBound(items, key) {
+    var lo = 0, hi = items.length;
+    while (lo < hi) {
+      var mid = (lo + hi) >>> 1;
+      if (items[mid][0] < key) {
+        lo = mid + 1;
+      } else {
+        hi = mid;
+      }
+    }
+
+    return lo;
+  }
+
+  // collect the rows of the sorted entries starting with the prefix
+  function prefixed(items, prefix, collect) {
+    for (var i = lowerBound(items, prefix); i < items.length; i++) {
+      if (items[i][0].lastIndexOf(prefix, 0) !== 0) {
+        break;
+      }
+
+      collect(items[i][1]);
+    }
+  }
+
+  function lookup(index, query) {
+    var words = query.toLowerCase().match(/[0-9a-z]{2,}/g) || [];
+    var found = null;
+
+    words.forEach(function (word) {
+      var rows = {};
+      var collect = function (row) {
+        if (typeof row === 'number') {
+          rows[row] = true;
+        } else {
+          row.forEach(function (r) { rows[r] = true; });
+        }
+      };
+
+      prefixed(index.tokens, word, collect);
+      if (/^[0-9a-f]+$/.test(word)) {
+        prefixed(index.sha1s, word, collect);
+      }
+
+      // all the words need to match
+      if (found === null) {
+        found = rows;
+      } else {
+        Object.keys(found).forEach(function (r) {
+          if (!rows[r]) {
+            delete found[r];
+          }
+        });
+      }
+    });
+
+    if (found === null) {
+      return [];
+    }
+
+    return Object.keys(found).map(Number).sort(function (a, b) {
+      return a - b;
+    });
+  }
+
+  function render(index, results, rows) {
+    while (results.firstChild) {
+      results.removeChild(results.firstChild);
+    }
+
+    rows.slice(0, LIMIT).forEach(function (row) {
+      var item = index.rows[row];
+      var link = document.createElement('a');
+
+      link.href = '#sha1-' + item[0];
+      link.className = 'd-block';
+      link.textContent =
+        item[0].substring(0, 12) + ' ' + item[1] + ' <' + item[2] + '>';
+      results.appendChild(link);
+    });
+
+    if (rows.length > LIMIT) {
+      var more = document.createElement('span');
+
+      more.className = 'badge badge-info';
+      more.textContent = (rows.length - LIMIT) + ' more';
+      results.appendChild(more);
+    }
+  }
+
+  var index = window.KREP_SEARCH;
+  var input = document.getElementById('krep-search');
+  var results = document.getElementById('krep-search-results');
+  if (!index || !input || !results) {
+    return;
+  }
+
+  var timer = null;
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      render(index, results, lookup(index, input.value));
+    }, 100);
+  });
+})();
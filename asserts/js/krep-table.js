@@ -0,0 +1,147 @@
+/*! krep table */
+(function () {
+  'use strict';
+
+  var REVERTED = 1;
+  var ANCHORED = 2;
+
+  function element(tag, text, attrs) {
+    var elem = document.createElement(tag);
+
+    if (text !== null && text !== undefined) {
+      elem.textContent = text;
+    }
+
+    for (var name in attrs || {}) {
+      if (attrs.hasOwnProperty(name)) {
+        elem.setAttribute(name, attrs[name]);
+      }
+    }
+
+    return elem;
+  }
+
+  function sha1Cell(conf, sha1, reverted) {
+    var td = element('td');
+    var pre = element('pre');
+
+    if (conf.name && (conf.gitiles || conf.remote)) {
+      var links = document.createDocumentFragment();
+      var query = conf.remote + '/#/q/' + sha1;
+
+      if (conf.gitiles) {
+        links.appendChild(element('a', sha1.substring(0, 20), {href: query}));
+        links.appendChild(element('a', sha1.substring(20), {
+          href: conf.remote + '/plugins/gitiles/' + conf.name + '/+/' +
+            sha1 + '^!'}));
+      } else {
+        links.appendChild(element('a', sha1, {href: query}));
+      }
+
+      if (reverted) {
+        var s = element('s');
+        s.appendChild(links);
+        pre.appendChild(s);
+      } else {
+        pre.appendChild(links);
+      }
+    } else if (reverted) {
+      pre.appendChild(element('s', sha1));
+    } else {
+      pre.textContent = sha1;
+    }
+
+    td.appendChild(pre);
+    return td;
+  }
+
+  function textCell(reverted, text, attrs) {
+    if (!reverted) {
+      return element('td', text, attrs);
+    }
+
+    var td = element('td', null, attrs);
+    td.appendChild(element('s', text));
+    return td;
+  }
+
+  function changeCell(conf, change) {
+    var number = change[0];
+    var changeId = change[1];
+    var attrs = {'class': 'align-middle'};
+    var td;
+
+    if (number && conf.remote) {
+      td = element('td', null, attrs);
+      td.appendChild(element('a', String(number), {
+        href: conf.remote + '/#/c/' + number + '/'}));
+    } else if (changeId && conf.remote) {
+      td = element('td', null, attrs);
+      td.appendChild(element('a', changeId.substring(0, 10), {
+        href: conf.remote + '/#/q/' + changeId, title: changeId}));
+    } else {
+      td = element(
+        'td', number ? String(number) : (changeId || '').substring(0, 10),
+        attrs);
+    }
+
+    return td;
+  }
+
+  function buildRow(conf, row) {
+    var reverted = (row[5] & REVERTED) !== 0;
+    var tr = element('tr');
+
+    if (row[5] & ANCHORED) {
+      tr.id = 'sha1-' + row[0];
+    }
+
+    tr.appendChild(sha1Cell(conf, row[0], reverted));
+    tr.appendChild(textCell(reverted, row[1]));
+
+    var author = element('td');
+    author.appendChild(element('a', row[2], {href: 'mailto:' + row[2]}));
+    tr.appendChild(author);
+
+    if (row[4]) {
+      tr.appendChild(textCell(reverted, row[3], {
+        'data-toggle': 'tooltip', 'data-html': 'true', title: row[4]}));
+    } else {
+      tr.appendChild(textCell(reverted, row[3], {'class': 'align-middle'}));
+    }
+
+    if (conf.roots) {
+      tr.appendChild(element('td', row[6], {'class': 'align-middle'}));
+    }
+
+    if (conf.changes) {
+      tr.appendChild(changeCell(conf, row[row.length - 1]));
+    }
+
+    return tr;
+  }
+
+  var tables = document.querySelectorAll('table.krep-compact');
+  for (var i = 0; i < tables.length; i++) {
+    var table = tables[i];
+    var payload = document.getElementById(table.getAttribute('data-rows'));
+    if (!payload) {
+      continue;
+    }
+
+    var conf = {
+      remote: table.getAttribute('data-remote'),
+      name: table.getAttribute('data-name'),
+      gitiles: table.getAttribute('data-gitiles') === '1',
+      roots: table.getAttribute('data-roots') === '1',
+      changes: table.getAttribute('data-changes') === '1'};
+    var rows = JSON.parse(payload.textContent);
+    var fragment = document.createDocumentFragment();
+
+    rows.forEach(function (row) {
+      fragment.appendChild(buildRow(conf, row));
+    });
+
+    (table.tBodies[0] || table).appendChild(fragment);
+  }
+})();
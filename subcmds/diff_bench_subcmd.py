@@ -0,0 +1,805 @@
+
+import binascii
+import hashlib
+import json
+import optparse as optparse_mod
+import os
+import sys
+import threading
+import time
+import zlib
+
+from git_diff_subcmd import Changes, CommitInfo, Details, GitDiffSubcmd, \
+  Result, SearchIndex, Statistics
+from repo_diff_subcmd import RepoDiffSubcmd
+from topics import DiffTrace, FormattedFile, GitProject, \
+  RaiseExceptionIfOptionMissed, SubCommand
+
+
+class _SyntheticRepo(object):
+  """Writes loose objects of a synthetic history into a bare repository."""
+
+  AUTHORS = (
+    ('Alice', 'alice@example.com'),
+    ('Bob', 'bob@example.org'),
+    ('Carol', 'carol@example.com'),
+    ('Dave', 'dave@example.net'),
+    ('Eve', 'eve@example.org'))
+
+  def __init__(self, gitdir, rand, dirs=8, files=16):
+    self.gitdir = gitdir
+    self.rand = rand
+    self.dirs = dirs
+    self.files = files
+    self.trees = dict()
+    self.blobs = dict()
+    self.clock = 1500000000
+    self.commits = list()
+
+    import subprocess
+
+    subprocess.check_call(['git', 'init', '-q', '--bare', gitdir])
+    with open(os.path.join(gitdir, 'HEAD'), 'w') as fp:
+      fp.write('ref: refs/heads/master\n')
+
+  def _write(self, kind, content):
+    data = ('%s %d\0' % (kind, len(content))).encode('utf-8') + content
+    sha1 = hashlib.sha1(data).hexdigest()
+
+    path = os.path.join(self.gitdir, 'objects', sha1[:2], sha1[2:])
+    if not os.path.exists(path):
+      dirname = os.path.dirname(path)
+      if not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+      with open(path, 'wb') as fp:
+        fp.write(zlib.compress(data))
+
+    return sha1
+
+  def _tree(self, entries):
+    content = b''
+    for mode, name, sha1 in sorted(entries, key=lambda e: e[1]):
+      content += ('%s %s\0' % (mode, name)).encode('utf-8')
+      content += binascii.unhexlify(sha1)
+
+    return self._write('tree', content)
+
+  def _touch(self, serial, fanout):
+    touched = set()
+    for _ in range(fanout):
+      dirname = 'd%02d' % self.rand.randrange(self.dirs)
+      fname = 'f%03d.txt' % self.rand.randrange(self.files)
+      self.blobs.setdefault(dirname, dict())[fname] = self._write(
+        'blob', ('%s/%s@%d\n' % (dirname, fname, serial)).encode('utf-8'))
+      touched.add(dirname)
+
+    for dirname in touched:
+      self.trees[dirname] = self._tree(
+        [('100644', name, sha1)
+         for name, sha1 in self.blobs[dirname].items()])
+
+    return self._tree(
+      [('40000', name, sha1) for name, sha1 in self.trees.items()])
+
+  def _commit(self, tree, parents, message):
+    name, email = self.rand.choice(_SyntheticRepo.AUTHORS)
+    self.clock += 3600
+
+    content = 'tree %s\n' % tree
+    for parent in parents:
+      content += 'parent %s\n' % parent
+
+    ident = '%s <%s> %d +0000' % (name, email, self.clock)
+    content += 'author %s\ncommitter %s\n\n%s\n' % (ident, ident, message)
+
+    return self._write('commit', content.encode('utf-8'))
+
+  def generate(self, commits, merge_ratio, revert_ratio, fanout):
+    head, titles = None, dict()
+
+    for serial in range(commits):
+      parents = [head] if head else []
+      dice = self.rand.random()
+      if head and dice < revert_ratio and self.commits:
+        reverted = self.rand.choice(self.commits)
+        title = 'Revert "%s"' % titles[reverted]
+        message = '%s\n\nThis reverts commit %s.' % (title, reverted)
+      else:
+        title = 'Change %d' % serial
+        message = title
+
+      if head and dice > 1 - merge_ratio:
+        side = self._commit(
+          self._touch(serial, fanout), [head], 'Side change %d' % serial)
+        parents.append(side)
+        title = 'Merge change %d' % serial
+        message = title
+
+      head = self._commit(self._touch(serial, fanout), parents, message)
+      titles[head] = title
+      self.commits.append(head)
+
+    with open(os.path.join(self.gitdir, 'refs', 'heads', 'master'), 'w') as fp:
+      fp.write('%s\n' % head)
+
+    return self.commits
+
+
+class _PhaseTimer(object):
+  """Accumulates the elapsed time of the wrapped static methods by phase."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.phases = dict()
+    self.originals = list()
+
+  def _wrap(self, phase, func):
+    def _timed(*args, **kws):
+      start = time.time()
+      try:
+        return func(*args, **kws)
+      finally:
+        with self.lock:
+          self.phases[phase] = \
+            self.phases.get(phase, 0.0) + time.time() - start
+
+    return _timed
+
+  def patch(self, clazz, attr, phase):
+    func = getattr(clazz, attr)
+    self.originals.append((clazz, attr, clazz.__dict__[attr]))
+    setattr(clazz, attr, staticmethod(self._wrap(phase, func)))
+
+  def restore(self):
+    for clazz, attr, func in reversed(self.originals):
+      setattr(clazz, attr, func)
+
+    self.originals = list()
+
+  def __enter__(self):
+    self.patch(GitDiffSubcmd, 'get_commits', 'git')
+    self.patch(GitDiffSubcmd, 'get_classified_commits', 'git')
+    self.patch(GitDiffSubcmd, 'get_commit_detail', 'git')
+    self.patch(GitDiffSubcmd, 'filter_commits', 'filter')
+    self.patch(GitDiffSubcmd, 'update_table', 'render')
+
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.restore()
+
+
+class _FormatSamples(object):
+  """Builds the deterministic commit details rendered by the HTML writer."""
+
+  REMOTE = 'https://review.example.com'
+  # the arguments of update_table besides the details and the commits
+  VARIANTS = (
+    ('plain', dict(gitiles=False)),
+    ('remote', dict(remote=REMOTE, name='bench', gitiles=False)),
+    ('gitiles', dict(remote=REMOTE, name='bench', gitiles=True)),
+    ('roots', dict(remote=REMOTE, name='bench', gitiles=True, labels=True,
+                   changes=True)),
+    ('search', dict(remote=REMOTE, name='bench', gitiles=False,
+                    search=True)),
+    ('compact', dict(remote=REMOTE, name='bench', gitiles=True,
+                     labels=True, search=True, compact=True, changes=True)))
+
+  def __init__(self, rows, seed):
+    import random
+
+    rand = random.Random(seed)
+
+    self.details = Details()
+    self.changes = Changes()
+    self.labels = dict()
+    self.logs = list()
+
+    roots = [hashlib.sha1(('root%d' % k).encode('utf-8')).hexdigest()
+             for k in range(3)]
+    for serial in range(rows):
+      sha1 = hashlib.sha1(('commit%d' % serial).encode('utf-8')).hexdigest()
+      name, email = rand.choice(_SyntheticRepo.AUTHORS)
+      date = time.strftime(
+        '%Y-%m-%d %H:%M:%S +0000', time.gmtime(1500000000 + serial * 3600))
+
+      dice = rand.random()
+      if self.logs and dice < 0.05:
+        reverted = rand.choice(self.logs)
+        title = 'Revert "%s"' % self.details.get(reverted).title
+        body = 'This reverts commit %s.' % reverted
+      else:
+        title = 'Change %d of <%s> & "%s"' % (serial, name, email)
+        body = 'Fix the <tag> & the "quotes" of %s' % name
+
+      info = 'commit %s\nAuthor: %s <%s>\nDate:   %s\n\n    %s\n\n' \
+        '    %s\n' % (sha1, name, email, date, title, body)
+      if dice > 0.3:
+        change_id = hashlib.sha1(
+          ('change%d' % serial).encode('utf-8')).hexdigest()
+        info += '\n    Change-Id: I%s\n' % change_id
+        if dice > 0.6:
+          self.changes.numbers[sha1] = (1000 + serial, 1 + serial % 3)
+
+      info += '\nd%02d/f%03d.txt\n' % (serial % 8, serial % 16)
+
+      self.details.put(
+        sha1, CommitInfo(sha1, date, email, email, title, info))
+      self.labels[sha1] = roots[:1 + serial % len(roots)]
+      self.logs.append(sha1)
+
+  def render(self, filename, variant):
+    kws = dict(variant)
+    if kws.pop('labels', False):
+      kws['labels'] = self.labels
+    if kws.pop('search', False):
+      kws['search'] = SearchIndex()
+      kws['anchors'] = set()
+    if kws.pop('changes', False):
+      kws['changes'] = self.changes
+
+    with FormattedFile.open(filename) as outfile:
+      with outfile.body() as bd:
+        with bd.div(id='accordion') as acc:
+          GitDiffSubcmd.update_table(
+            acc, self.details, self.logs, 1, 'Commits', **kws)
+
+  def render_plain(self, filename):
+    """Writes the rows by plain string formatting to calibrate the machine."""
+    def _escape(val):
+      return val.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;').replace('"', '&quot;')
+
+    with open(filename, 'w') as fp:
+      fp.write('<html><body><table>\n')
+      for sha1 in self.logs:
+        commit = self.details.get(sha1)
+        fp.write(
+          '<tr><td><pre>%s</pre></td><td>%s</td><td><a href="mailto:%s">%s'
+          '</a></td><td title="%s">%s</td></tr>\n' % (
+            sha1, commit.date, _escape(commit.author),
+            _escape(commit.author), _escape(commit.info),
+            _escape(commit.title)))
+      fp.write('</table></body></html>\n')
+
+  def render_index(self, output, projects):
+    """Writes the repo-diff index of the sample projects."""
+    options = optparse_mod.Values(dict(gitiles=True))
+
+    first, second, results = dict(), dict(), dict()
+    stats = Statistics()
+    for k in range(projects):
+      name = 'platform/bench%03d' % k
+      if k % 4 != 0:
+        first[name] = name
+      if k % 4 != 1:
+        second[name] = name
+        logs = self.logs[k::projects]
+        results[name] = Result(
+          _FormatSamples.REMOTE if k % 2 else None,
+          len(logs) if k % 4 != 2 else 0, 0,
+          len(logs) // 2 if k % 4 != 2 else 0, 0)
+
+    for sha1 in self.logs:
+      stats.add(self.details.get(sha1))
+
+    RepoDiffSubcmd.generate_index(
+      options, output, first, second, results, stats,
+      {'platform/bench003': 'platform/bench007'})
+
+
+class DiffBenchSubcmd(SubCommand):
+  COMMAND = 'diff-bench'
+
+  IMPORT_PLUGINS = (
+    'git_diff_subcmd', 'repo_diff_subcmd', 'repo_diff_server_subcmd',
+    'diff_bench_subcmd')
+  # the modules expected to be loaded only when the sub-commands run
+  IMPORT_DEFERRED = (
+    'BaseHTTPServer', 'cProfile', 'http.server', 'krep_subcmds.repo_subcmd',
+    'krep_subcmds.repo_mirror_subcmd', 'mmap', 'pickle', 'random',
+    'socketserver', 'SocketServer', 'subprocess', 'tempfile', 'tracemalloc')
+  IMPORT_SCRIPT = """\
+import json, sys, time
+import topics
+loaded = set(sys.modules)
+start = time.time()
+__import__(sys.argv[1])
+elapsed = time.time() - start
+modules = sorted(set(sys.modules) - loaded)
+print(json.dumps({'time': elapsed, 'modules': modules}))
+"""
+
+  # the golden pages and the recorded results shipped with the plug-ins
+  GOLDEN = 'bench/golden'
+  BASELINE = 'bench/baseline.json'
+  # the parameters to be equal to compare the format benchmark
+  GATE_PARAMS = ('format_rows', 'seed')
+
+  help_summary = 'Benchmark git-diff and repo-diff with synthetic repositories'
+  help_usage = """\
+%prog [options] ...
+
+Generates synthetic git repositories and a pair of repo manifests locally and
+times the report generation of git-diff and repo-diff.
+
+The elapsed time is collected both end to end and per phase (git I/O,
+filtering and rendering) and written as JSON, which can be compared with the
+output of a previous run with the option --compare.
+
+The import benchmark times the import of each plug-in in a fresh interpreter
+and lists the modules it loads, the ones only needed to run the sub-commands
+are reported if loaded.
+
+The format benchmark renders the commit tables of update_table in each
+variant and the repo-diff index from deterministic samples. The rows written
+per second, also relative to the same rows written by plain string formatting
+on the machine, and the peak memory traced while rendering are measured. The
+rendered pages are compared byte for byte with the golden pages in bench/golden
+or the option --golden, which are written with the option --update-golden into
+the directory of --golden. A golden page not matched or the median relative
+rows per second of --format-repeat runs dropping more than --max-regression
+below the results recorded in bench/baseline.json, the option --baseline or
+the results of --compare fails the benchmark. The results taken with another
+--format-rows or --seed aren't compared. The baseline is recorded by writing
+the results of the format benchmark into it with --bench-output."""
+
+  def options(self, optparse):
+    SubCommand.options(self, optparse, modules=globals())
+
+    options = optparse.add_option_group('Benchmark options')
+    options.add_option(
+      '--bench',
+      dest='bench', action='store', default='all',
+      type='choice',
+      choices=('all', 'git-diff', 'repo-diff', 'import', 'format'),
+      help='Set the sub-command to benchmark, default: %default')
+    options.add_option(
+      '--commits',
+      dest='commits', action='store', type='int', default=1000,
+      help='Set the commit count of each repository, default: %default')
+    options.add_option(
+      '--merge-ratio',
+      dest='merge_ratio', action='store', type='float', default=0.1,
+      help='Set the ratio of merge commits, default: %default')
+    options.add_option(
+      '--revert-ratio',
+      dest='revert_ratio', action='store', type='float', default=0.02,
+      help='Set the ratio of revert commits, default: %default')
+    options.add_option(
+      '--fanout',
+      dest='fanout', action='store', type='int', default=3,
+      help='Set the files changed by each commit, default: %default')
+    options.add_option(
+      '--projects',
+      dest='projects', action='store', type='int', default=10,
+      help='Set the project count in the manifest, default: %default')
+    options.add_option(
+      '--repeat',
+      dest='repeat', action='store', type='int', default=3,
+      help='Set the times to run each benchmark, default: %default')
+    options.add_option(
+      '--seed',
+      dest='seed', action='store', type='int', default=0,
+      help='Set the seed of the synthetic history, default: %default')
+    options.add_option(
+      '--bench-dir',
+      dest='bench_dir', action='store',
+      help='Set the directory to keep the synthetic repositories')
+    options.add_option(
+      '--bench-output',
+      dest='bench_output', action='store', default='bench.json',
+      help='Set the file to write the results, default: %default')
+    options.add_option(
+      '--compare',
+      dest='compare', action='store',
+      help='Compare with the results of a previous run')
+    options.add_option(
+      '--max-regression',
+      dest='max_regression', action='store', type='float', default=0.3,
+      help='Set the ratio of the rows per second, relative to the plain '
+           'rows, allowed to drop below the compared results, '
+           'default: %default')
+
+    options = optparse.add_option_group('Format options')
+    options.add_option(
+      '--format-rows',
+      dest='format_rows', action='store', type='int', default=2000,
+      help='Set the rows rendered to measure the throughput, '
+           'default: %default')
+    options.add_option(
+      '--format-repeat',
+      dest='format_repeat', action='store', type='int', default=7,
+      help='Set the times to render each table, the median of which is '
+           'compared, default: %default')
+    options.add_option(
+      '--golden',
+      dest='golden', action='store',
+      help='Set the directory of the golden pages to compare with, '
+           'default: %s' % DiffBenchSubcmd.GOLDEN)
+    options.add_option(
+      '--update-golden',
+      dest='update_golden', action='store_true', default=False,
+      help='Write the rendered pages as the golden ones into the directory '
+           'of --golden')
+    options.add_option(
+      '--baseline',
+      dest='baseline', action='store',
+      help='Set the results to hold the rows per second of, '
+           'default: %s' % DiffBenchSubcmd.BASELINE)
+
+  @staticmethod
+  def _generate(path, options, seed):
+    import random
+
+    rand = random.Random(seed)
+
+    repo = _SyntheticRepo(path, rand)
+    return repo.generate(
+      options.commits, options.merge_ratio, options.revert_ratio,
+      options.fanout)
+
+  @staticmethod
+  def _write_manifest(filename, revisions):
+    with open(filename, 'w') as fp:
+      fp.write('<?xml version="1.0" encoding="UTF-8"?>\n<manifest>\n')
+      fp.write('  <remote name="origin" fetch=".."/>\n')
+      fp.write('  <default remote="origin" revision="master"/>\n')
+      for name in sorted(revisions):
+        fp.write('  <project name="%s" path="%s" revision="%s"/>\n' % (
+          name, name, revisions[name]))
+      fp.write('</manifest>\n')
+
+  @staticmethod
+  def _measure(name, serial, func, *args, **kws):
+    with _PhaseTimer() as timer:
+      start = time.time()
+      func(*args, **kws)
+      total = time.time() - start
+
+    return {
+      'name': name, 'serial': serial, 'total': total,
+      'phases': timer.phases}
+
+  def bench_git_diff(self, options, workdir):
+    import shutil
+
+    path = os.path.join(workdir, 'git-diff.git')
+    if not os.path.exists(path):
+      self._generate(path, options, options.seed)
+
+    project = GitProject(None, worktree=path)
+    _, head = project.rev_parse('HEAD')
+    _, root = project.rev_list('--max-parents=0', 'HEAD')
+
+    rets = list()
+    for serial in range(options.repeat):
+      output = os.path.join(workdir, 'out-git-diff')
+      if os.path.exists(output):
+        shutil.rmtree(output)
+
+      trace = DiffTrace()
+      rets.append(DiffBenchSubcmd._measure(
+        'git-diff', serial, GitDiffSubcmd.generate_report,
+        [root.split('\n')[0], head], project, 'bench', output, output,
+        None, None, False, True, None, True, trace=trace))
+      rets[-1]['trace'] = trace.summary()
+
+    return rets
+
+  def bench_repo_diff(self, options, workdir):
+    import shutil
+
+    mirror = os.path.join(workdir, 'mirror')
+    baseline, target = dict(), dict()
+    for k in range(options.projects):
+      name = 'bench%03d' % k
+      path = os.path.join(mirror, '%s.git' % name)
+      if os.path.exists(path):
+        project = GitProject(None, worktree=path)
+        _, sha1s = project.rev_list('--first-parent', '--reverse', 'HEAD')
+        commits = sha1s.split('\n')
+      else:
+        commits = self._generate(path, options, options.seed + k)
+
+      baseline[name] = commits[len(commits) // 2]
+      target[name] = commits[-1]
+
+    first = os.path.join(workdir, 'baseline.xml')
+    second = os.path.join(workdir, 'target.xml')
+    DiffBenchSubcmd._write_manifest(first, baseline)
+    DiffBenchSubcmd._write_manifest(second, target)
+
+    subcmd = RepoDiffSubcmd()
+    parser = optparse_mod.OptionParser()
+    subcmd.options(parser)
+    opts, _ = parser.parse_args([])
+
+    opts.mirror = True
+    opts.working_dir = mirror
+    opts.job = getattr(options, 'job', None) or 1
+
+    rets = list()
+    for serial in range(options.repeat):
+      opts.output = os.path.join(workdir, 'out-repo-diff')
+      if os.path.exists(opts.output):
+        shutil.rmtree(opts.output)
+
+      opts.trace = os.path.join(workdir, 'trace-repo-diff.json')
+      rets.append(DiffBenchSubcmd._measure(
+        'repo-diff', serial, subcmd.execute, opts, first, second))
+      with open(opts.trace, 'r') as fp:
+        rets[-1]['trace'] = json.load(fp)['projects']
+
+    return rets
+
+  def bench_import(self, options):
+    import subprocess
+
+    # the plug-ins are imported in fresh interpreters after the topics which
+    # krep has loaded before them
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+      [os.path.dirname(os.path.abspath(__file__))] + [
+        path for path in sys.path if path])
+
+    rets = list()
+    for plugin in DiffBenchSubcmd.IMPORT_PLUGINS:
+      for serial in range(options.repeat):
+        output = subprocess.check_output(
+          [sys.executable, '-c', DiffBenchSubcmd.IMPORT_SCRIPT, plugin],
+          env=env)
+        loaded = json.loads(output.decode('utf-8'))
+
+        rets.append({
+          'name': 'import %s' % plugin, 'serial': serial,
+          'total': loaded['time'], 'phases': dict(),
+          'modules': loaded['modules'],
+          'deferred': sorted(
+            set(loaded['modules']) & set(DiffBenchSubcmd.IMPORT_DEFERRED))})
+
+        if rets[-1]['deferred']:
+          print('%s loads %s at import' % (
+            plugin, ', '.join(rets[-1]['deferred'])))
+
+    return rets
+
+  @staticmethod
+  def _render_golden(output):
+    import shutil
+
+    if os.path.exists(output):
+      shutil.rmtree(output)
+    os.makedirs(output)
+
+    # the golden pages keep the rows few to be reviewed by their diffs
+    samples = _FormatSamples(40, 0)
+    for name, variant in _FormatSamples.VARIANTS:
+      samples.render(os.path.join(output, 'table-%s.html' % name), variant)
+
+    samples.render_index(output, 12)
+
+    return ['table-%s.html' % name for name, _ in _FormatSamples.VARIANTS] \
+      + [RepoDiffSubcmd.INDEX_HTML]
+
+  @staticmethod
+  def bundled(path):
+    return os.path.realpath(
+      '%s/../%s' % (os.path.dirname(os.path.abspath(__file__)), path))
+
+  @staticmethod
+  def check_golden(directory, update, workdir):
+    import difflib
+    import shutil
+
+    output = os.path.join(workdir, 'out-format')
+    pages = DiffBenchSubcmd._render_golden(output)
+
+    if update:
+      if not os.path.exists(directory):
+        os.makedirs(directory)
+
+      for page in pages:
+        shutil.copyfile(
+          os.path.join(output, page), os.path.join(directory, page))
+        print('Update golden %s' % page)
+
+      return list()
+
+    mismatched = list()
+    for page in pages:
+      golden = os.path.join(directory, page)
+      if not os.path.exists(golden):
+        print('No golden %s' % page)
+        mismatched.append(page)
+        continue
+
+      with open(golden, 'rb') as fp:
+        expected = fp.read()
+      with open(os.path.join(output, page), 'rb') as fp:
+        rendered = fp.read()
+
+      if expected != rendered:
+        mismatched.append(page)
+        diff = list(difflib.unified_diff(
+          expected.decode('utf-8').splitlines(),
+          rendered.decode('utf-8').splitlines(),
+          golden, page, lineterm='', n=1))
+        print('\n'.join(diff[:20]))
+
+    return mismatched
+
+  def bench_format(self, options, workdir):
+    try:
+      import tracemalloc
+    except ImportError:
+      tracemalloc = None
+
+    output = os.path.join(workdir, 'out-format')
+    if not os.path.exists(output):
+      os.makedirs(output)
+
+    samples = _FormatSamples(options.format_rows, options.seed)
+    filename = os.path.join(output, 'throughput.html')
+
+    rets = list()
+    for name, variant in _FormatSamples.VARIANTS:
+      for serial in range(options.format_repeat):
+        # the plain rows written next to each run take the machine speed
+        # and load off the relative throughput, rendered for a while to be
+        # measured as steadily as the tables
+        start, rows = time.time(), 0
+        while not rows or time.time() - start < 0.2:
+          samples.render_plain(filename)
+          rows += options.format_rows
+        plain = rows / max(time.time() - start, 1e-9)
+
+        rets.append(DiffBenchSubcmd._measure(
+          'format %s' % name, serial, samples.render, filename, variant))
+        rets[-1]['rows'] = options.format_rows
+        rets[-1]['rows_per_sec'] = \
+          options.format_rows / max(rets[-1]['total'], 1e-9)
+        rets[-1]['relative'] = rets[-1]['rows_per_sec'] / plain
+
+      # measured apart as the tracing slows the rendering down
+      if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+          samples.render(filename, variant)
+          _, peak = tracemalloc.get_traced_memory()
+        finally:
+          tracemalloc.stop()
+
+        rets[-1]['peak_bytes'] = peak
+
+    return rets
+
+  @staticmethod
+  def gate(previous, current, tolerance):
+    """Returns the benchmarks regressed against the previous results."""
+    # the rows rendered are only comparable from the same samples
+    for param in DiffBenchSubcmd.GATE_PARAMS:
+      if previous.get('params', {}).get(param) != \
+          current['params'].get(param):
+        print('Skip the gate as %s differs from the compared results' % (
+          param))
+        return list()
+
+    def _median(runs):
+      values = dict()
+      for run in runs:
+        if 'relative' in run:
+          values.setdefault(run['name'], list()).append(run['relative'])
+
+      return dict((name, sorted(vals)[len(vals) // 2])
+                  for name, vals in values.items())
+
+    pmedian = _median(previous['results'])
+    cmedian = _median(current['results'])
+
+    regressed = list()
+    for name in sorted(cmedian):
+      if name in pmedian and \
+          cmedian[name] < pmedian[name] * (1 - tolerance):
+        print('%s: %.3f of the plain rows/s below the baseline %.3f' % (
+          name, cmedian[name], pmedian[name]))
+        regressed.append(name)
+
+    return regressed
+
+  @staticmethod
+  def compare(previous, current):
+    def _best(runs):
+      rets = dict()
+      for run in runs:
+        if run['name'] not in rets or run['total'] < rets[run['name']]:
+          rets[run['name']] = run['total']
+
+      return rets
+
+    pbest, cbest = _best(previous['results']), _best(current['results'])
+    for name in sorted(cbest):
+      if name in pbest and pbest[name]:
+        print('%s: %.3fs -> %.3fs (%+.1f%%)' % (
+          name, pbest[name], cbest[name],
+          (cbest[name] - pbest[name]) * 100.0 / pbest[name]))
+
+  def execute(self, options, *args, **kws):
+    import platform
+    import shutil
+    import tempfile
+
+    SubCommand.execute(self, options, *args, **kws)
+
+    if options.update_golden:
+      RaiseExceptionIfOptionMissed(
+        options.golden, "golden need set to update the golden pages")
+
+    workdir = options.bench_dir
+    if workdir:
+      if not os.path.exists(workdir):
+        os.makedirs(workdir)
+    else:
+      workdir = tempfile.mkdtemp(prefix='krep-bench-')
+
+    report = {
+      'timestamp': time.time(),
+      'python': platform.python_version(),
+      'params': {
+        'commits': options.commits, 'merge_ratio': options.merge_ratio,
+        'revert_ratio': options.revert_ratio, 'fanout': options.fanout,
+        'projects': options.projects, 'repeat': options.repeat,
+        'seed': options.seed, 'format_rows': options.format_rows,
+        'format_repeat': options.format_repeat},
+      'results': list()}
+
+    try:
+      if options.bench in ('all', 'git-diff'):
+        report['results'].extend(self.bench_git_diff(options, workdir))
+      if options.bench in ('all', 'repo-diff'):
+        report['results'].extend(self.bench_repo_diff(options, workdir))
+      if options.bench in ('all', 'import'):
+        report['results'].extend(self.bench_import(options))
+      if options.bench in ('all', 'format'):
+        report['results'].extend(self.bench_format(options, workdir))
+        report['golden'] = DiffBenchSubcmd.check_golden(
+          options.golden or DiffBenchSubcmd.bundled(DiffBenchSubcmd.GOLDEN),
+          options.update_golden, workdir)
+    finally:
+      if not options.bench_dir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for run in report['results']:
+      print('%s #%d: %.3fs %s' % (
+        run['name'], run['serial'], run['total'],
+        ', '.join('%s=%.3fs' % (phase, val)
+                  for phase, val in sorted(run['phases'].items()))))
+      if 'rows_per_sec' in run:
+        print('  %.0f rows/s (%.3f of plain)%s' % (
+          run['rows_per_sec'], run['relative'],
+          ', %.0f KiB traced at peak' % (run['peak_bytes'] / 1024.0)
+          if 'peak_bytes' in run else ''))
+
+    with open(options.bench_output, 'w') as fp:
+      json.dump(report, fp, indent=2, sort_keys=True)
+
+    passed = not report.get('golden')
+    baseline = options.baseline or \
+      DiffBenchSubcmd.bundled(DiffBenchSubcmd.BASELINE)
+    if (options.baseline or os.path.exists(baseline)) and \
+        options.bench in ('all', 'format'):
+      with open(baseline, 'r') as fp:
+        if DiffBenchSubcmd.gate(
+            json.load(fp), report, options.max_regression):
+          passed = False
+
+    if options.compare:
+      with open(options.compare, 'r') as fp:
+        previous = json.load(fp)
+
+      DiffBenchSubcmd.compare(previous, report)
+      if DiffBenchSubcmd.gate(previous, report, options.max_regression):
+        passed = False
+
+    return passed
@@ -1,43 +1,162 @@
 
+import binascii
+import contextlib
+import glob
 import json
 import os
 import re
+import struct
+import threading
 import time
-import shutil
+import zlib
 
-from collections import namedtuple
+from collections import Counter, namedtuple
 from synchronize import synchronized
 
-try:
-  from urllib.parse import urlparse
-except ImportError:
-  from urlparse import urlparse
+# krep loads all the plug-ins for any sub-command, the modules only used to
+# generate the reports are imported in the methods using them
 
-from topics import FormattedFile, GitProject, Pattern, \
-  RaiseExceptionIfOptionMissed, SubCommand
+from topics import AtomicFile, DiffTrace, FormattedFile, GitProject, \
+  Pattern, RaiseExceptionIfOptionMissed, SubCommand
 
 
 CommitInfo = namedtuple('CommitInfo', 'sha1,date,author,committer,title,info')
 
 
+class ResultStore(object):
+  """Keeps the results of all the projects of a run in one file."""
+
+  FILENAME = 'results.jsonl'
+
+  def __init__(self, output):
+    self.filename = os.path.join(output, ResultStore.FILENAME)
+    self.values = dict()
+    self.stats = dict()
+    # the projects rendered from the ranges collected by another one
+    self.shared = dict()
+    self.lock = threading.Lock()
+
+    lines = 0
+    if os.path.exists(self.filename):
+      with open(self.filename, 'r') as fp:
+        for line in fp:
+          lines += 1
+          # the last line might be partially written
+          if not line.endswith('\n'):
+            break
+
+          try:
+            record = json.loads(line)
+          except ValueError:
+            continue
+
+          if 'stats' in record:
+            self.stats[record.get('name')] = record['stats']
+          elif 'shared' in record:
+            self.shared[record.get('name')] = record['shared']
+          elif record.get('value') is None:
+            self.values.pop(record.get('name'), None)
+            self.stats.pop(record.get('name'), None)
+            self.shared.pop(record.get('name'), None)
+          else:
+            self.values[record.get('name')] = record['value']
+
+      if lines > len(self.values) + len(self.stats) + len(self.shared):
+        self._compact()
+
+    self.fp = open(self.filename, 'a')
+
+  @staticmethod
+  def _line(name, value, key='value'):
+    return '%s\n' % json.dumps({'name': name, key: value}, sort_keys=True)
+
+  def _compact(self):
+    with AtomicFile(self.filename) as fp:
+      for name in sorted(self.values):
+        fp.write(ResultStore._line(name, self.values[name]))
+      for name in sorted(self.stats):
+        fp.write(ResultStore._line(name, self.stats[name], 'stats'))
+      for name in sorted(self.shared):
+        fp.write(ResultStore._line(name, self.shared[name], 'shared'))
+
+  def __contains__(self, name):
+    return name in self.values
+
+  def get(self, name):
+    with self.lock:
+      return self.values.get(name)
+
+  def put(self, name, value):
+    with self.lock:
+      if value is None:
+        self.values.pop(name, None)
+        self.stats.pop(name, None)
+        self.shared.pop(name, None)
+      else:
+        self.values[name] = list(value)
+
+      self.fp.write(ResultStore._line(name, value))
+      self.fp.flush()
+
+  def get_stats(self, name):
+    with self.lock:
+      return self.stats.get(name)
+
+  def put_stats(self, name, stats):
+    with self.lock:
+      self.stats[name] = stats
+      self.fp.write(ResultStore._line(name, stats, 'stats'))
+      self.fp.flush()
+
+  def get_shared(self, name):
+    with self.lock:
+      return self.shared.get(name)
+
+  def put_shared(self, name, owner):
+    with self.lock:
+      self.shared[name] = owner
+      self.fp.write(ResultStore._line(name, owner, 'shared'))
+      self.fp.flush()
+
+  def discard(self, name):
+    if name in self.values or name in self.stats or name in self.shared:
+      self.put(name, None)
+
+  def close(self):
+    self.fp.close()
+
+
 class Persist(object):
-  def __init__(self, filename, full=0, no_merge=0, filter=0, filter_no_merge=0):
+  def __init__(self, filename, full=0, no_merge=0, filter=0, filter_no_merge=0,
+               store=None, name=None):
     self.filename = filename
     self.full = full
     self.no_merge = no_merge
     self.filter = filter
     self.filter_no_merge = filter_no_merge
+    # with a store, the values are kept by the name instead of the file
+    self.store = store
+    self.name = name
 
   def __len__(self):
     return len(self.full) + len(self.no_merge) \
       + len(self.filter) + len(self.filter_no_merge)
 
   def dump(self):
-    with open(self.filename, 'w') as fp:
-      json.dump([self.full, self.no_merge, self.filter, self.no_merge], fp)
+    if self.store is not None:
+      self.store.put(self.name, self.value())
+      return
+
+    # replace the file at once to leave no partial result if interrupted
+    with AtomicFile(self.filename) as fp:
+      json.dump(self.value(), fp)
 
   def load(self):
-    if self.filename and os.path.exists(self.filename):
+    if self.store is not None:
+      value = self.store.get(self.name)
+      if value:
+        self.full, self.no_merge, self.filter, self.filter_no_merge = value
+    elif self.filename and os.path.exists(self.filename):
       with open(self.filename, 'r') as fp:
         self.full, self.no_merge, self.filter, self.filter_no_merge = \
           json.load(fp)
@@ -48,12 +167,28 @@ class Persist(object):
   def value(self):
     return [self.full, self.no_merge, self.filter, self.filter_no_merge]
 
+  def spill(self, spill):
+    """Spills the lists over the budget and returns the bytes charged."""
+    charged = 0
+    for attr in ('full', 'no_merge', 'filter', 'filter_no_merge'):
+      sha1s = getattr(self, attr)
+      # estimate the strings with their references in the list
+      size = 64 * len(sha1s)
+      if spill.charge(size):
+        charged += size
+      else:
+        setattr(self, attr, SpilledList(spill, sha1s))
+
+    return charged
+
 
 class Result(Persist):
   def __init__(self, remote=None, full=0, no_merge=0,
-               filter=0, filter_no_merge=0, filename=None):
+               filter=0, filter_no_merge=0, filename=None, store=None,
+               name=None):
 
-    Persist.__init__(self, filename, full, no_merge, filter, filter_no_merge)
+    Persist.__init__(
+      self, filename, full, no_merge, filter, filter_no_merge, store, name)
 
     self.remote = remote
     self.load()
@@ -90,22 +225,105 @@ class Result(Persist):
         filter_no_merge=self.filter_no_merge, override=override)
 
 
+class SpillStore(object):
+  """Spills the commit details and the SHA-1 lists over a memory budget."""
+
+  def __init__(self, budget, directory=None):
+    self.budget = budget
+    self.directory = directory
+    self.used = 0
+    self.fp = None
+    self.lock = threading.Lock()
+
+  def charge(self, size):
+    with self.lock:
+      if self.used + size > self.budget:
+        return False
+
+      self.used += size
+      return True
+
+  def reserve(self, size):
+    """Charges the bytes kept in memory anyway, even over the budget."""
+    with self.lock:
+      self.used += size
+
+  def release(self, size):
+    with self.lock:
+      self.used -= size
+
+  def write(self, data):
+    with self.lock:
+      if self.fp is None:
+        import tempfile
+
+        self.fp = tempfile.TemporaryFile(dir=self.directory)
+
+      self.fp.seek(0, os.SEEK_END)
+      offset = self.fp.tell()
+      self.fp.write(data)
+
+      return offset, len(data)
+
+  def read(self, offset, size):
+    with self.lock:
+      self.fp.seek(offset)
+      return self.fp.read(size)
+
+  def close(self):
+    if self.fp is not None:
+      self.fp.close()
+      self.fp = None
+
+
+class SpilledList(object):
+  """Reads a spilled SHA-1 list back in chunks while iterated."""
+
+  CHUNK = 4096
+
+  def __init__(self, spill, sha1s):
+    self.spill = spill
+    self.count = len(sha1s)
+    self.width = len(sha1s[0]) if sha1s else 0
+    self.offset, _ = spill.write(''.join(sha1s).encode('ascii'))
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    for start in range(0, self.count, SpilledList.CHUNK):
+      num = min(SpilledList.CHUNK, self.count - start)
+      data = self.spill.read(
+        self.offset + start * self.width, num * self.width).decode('ascii')
+      for k in range(num):
+        yield data[k * self.width:(k + 1) * self.width]
+
+  def __contains__(self, sha1):
+    return any(item == sha1 for item in self)
+
+
 class Details(object):
   REVERTED_MATCHER = re.compile(
     r"This reverts commit ([a-f0-9]+)\.", re.MULTILINE)
 
-  def __init__(self):
+  def __init__(self, spill=None):
     self.info = dict()
     self.reverted = set()
+    # the details over the budget are kept by their offsets in the spill
+    self.spill = spill
+    self.spilled = dict()
+    self.charged = 0
 
   def __contains__(self, sha1):
-    return sha1 in self.info
+    return sha1 in self.info or sha1 in self.spilled
 
   def __getattr__(self, sha1):
-    return self.info.get(sha1)
+    return self.get(sha1)
+
+  def __len__(self):
+    return len(self.info) + len(self.spilled)
 
   def put(self, sha1, commit):
-    self.info[sha1] = commit
     # detect the reverted commit
     if commit.title and commit.title.startswith('Revert "'):
       revisions = re.findall(Details.REVERTED_MATCHER, commit.info)
@@ -114,16 +332,254 @@ class Details(object):
         for rev in revisions:
           self.reverted.add(rev)
 
+    if self.spill is not None:
+      size = sum(len(val) for val in commit if val)
+      if not self.spill.charge(size):
+        self.spilled[sha1] = self.spill.write(
+          json.dumps(list(commit)).encode('utf-8'))
+        return
+
+      self.charged += size
+
+    self.info[sha1] = commit
+
   def get(self, sha1):
-    return self.info.get(sha1)
+    commit = self.info.get(sha1)
+    if commit is None and sha1 in self.spilled:
+      commit = CommitInfo(*json.loads(
+        self.spill.read(*self.spilled[sha1]).decode('utf-8')))
+
+    return commit
+
+  def close(self):
+    if self.spill is not None:
+      self.spill.release(self.charged)
+      self.charged = 0
 
   def is_reverted(self, sha1):
     return sha1 in self.reverted
 
 
+class Statistics(object):
+  """Counts the commits by author, committer domain and month."""
+
+  def __init__(self):
+    self.commits = 0
+    self.authors = Counter()
+    self.domains = Counter()
+    self.months = Counter()
+
+  def add(self, commit):
+    self.commits += 1
+    self.authors[commit.author] += 1
+    self.domains[commit.committer.rpartition('@')[2] or 'Unknown'] += 1
+    # the date is formatted like "2018-01-31 12:00:00 +0800"
+    self.months[commit.date[:7]] += 1
+
+  def merge(self, other):
+    self.commits += other.commits
+    self.authors.update(other.authors)
+    self.domains.update(other.domains)
+    self.months.update(other.months)
+
+    return self
+
+  def value(self):
+    return {
+      'commits': self.commits, 'authors': dict(self.authors),
+      'domains': dict(self.domains), 'months': dict(self.months)}
+
+  @staticmethod
+  def load(value):
+    stats = Statistics()
+    if value:
+      stats.commits = value['commits']
+      stats.authors.update(value['authors'])
+      stats.domains.update(value['domains'])
+      stats.months.update(value['months'])
+
+    return stats
+
+
+class Snapshot(object):
+  """Keeps the listed SHA-1s of each project to compare with a later run."""
+
+  FILENAME = 'snapshot.bin'
+  MAGIC = b'KRSN\x01'
+
+  def __init__(self):
+    self.projects = dict()
+    self.lock = threading.Lock()
+
+  def add(self, name, sha1s):
+    with self.lock:
+      self.projects[name] = frozenset(sha1s)
+
+  def retain(self, names):
+    with self.lock:
+      for name in list(self.projects):
+        if name not in names:
+          del self.projects[name]
+
+  def delta(self, previous):
+    rets = dict()
+    for name in set(self.projects) | set(previous.projects):
+      current = self.projects.get(name, frozenset())
+      origin = previous.projects.get(name, frozenset())
+      if current != origin:
+        rets[name] = (current - origin, origin - current)
+
+    return rets
+
+  def dump(self, filename):
+    data = [Snapshot.MAGIC, struct.pack('>I', len(self.projects))]
+    for name in sorted(self.projects):
+      bname = name.encode('utf-8')
+      data.append(struct.pack('>HI', len(bname), len(self.projects[name])))
+      data.append(bname)
+      data.extend(
+        binascii.unhexlify(sha1) for sha1 in sorted(self.projects[name]))
+
+    with AtomicFile(filename, 'wb') as fp:
+      fp.write(zlib.compress(b''.join(data)))
+
+  @staticmethod
+  def load(filename):
+    snapshot = Snapshot()
+    if not os.path.exists(filename):
+      return snapshot
+
+    with open(filename, 'rb') as fp:
+      data = zlib.decompress(fp.read())
+
+    if not data.startswith(Snapshot.MAGIC):
+      raise ValueError('%s is not a snapshot' % filename)
+
+    offset = len(Snapshot.MAGIC)
+    count, = struct.unpack_from('>I', data, offset)
+    offset += 4
+    for _ in range(count):
+      size, num = struct.unpack_from('>HI', data, offset)
+      offset += 6
+      name = data[offset:offset + size].decode('utf-8')
+      offset += size
+      snapshot.projects[name] = frozenset(
+        binascii.hexlify(data[pos:pos + 20]).decode('ascii')
+        for pos in range(offset, offset + num * 20, 20))
+      offset += num * 20
+
+    return snapshot
+
+
+class Changes(object):
+  """Maps the commits to their gerrit changes."""
+
+  CHANGE_ID_MATCHER = re.compile(
+    r'^\s+Change-Id: (I[0-9a-f]{40})\s*$', re.MULTILINE)
+  CHANGE_REF_MATCHER = re.compile(r'^refs/changes/\d+/(\d+)/(\d+)$')
+
+  def __init__(self):
+    self.numbers = dict()
+
+  def load(self, project):
+    ret, refs = project.for_each_ref(
+      '--format=%(objectname) %(refname)', 'refs/changes/')
+    if ret != 0:
+      return self
+
+    for line in refs.split('\n'):
+      sha1, _, ref = line.strip().strip('"').partition(' ')
+      matched = Changes.CHANGE_REF_MATCHER.match(ref)
+      if matched:
+        change = int(matched.group(1)), int(matched.group(2))
+        if change[1] > self.numbers.get(sha1, (0, 0))[1]:
+          self.numbers[sha1] = change
+
+    return self
+
+  def get(self, commit):
+    change_ids = Changes.CHANGE_ID_MATCHER.findall(commit.info or '')
+    # the last trailer is the one gerrit takes
+    return (
+      self.numbers.get(commit.sha1, (None,))[0],
+      change_ids[-1] if change_ids else None)
+
+
+class SecondaryIndex(object):
+  """Indexes the commits by author and by top-level path."""
+
+  PAGES = (('authors', 'authors.html'), ('paths', 'paths.html'))
+
+  def __init__(self):
+    self.authors = dict()
+    self.paths = dict()
+
+  @staticmethod
+  def top_paths(info):
+    paths = list()
+    header = True
+    for line in (info or '').split('\n'):
+      if header:
+        # the header ends with the first empty line
+        header = bool(line)
+      elif line and not line.startswith('    '):
+        top = line.split('/', 1)[0] if '/' in line else '/'
+        if top not in paths:
+          paths.append(top)
+
+    return paths
+
+  def add(self, commit):
+    self.authors.setdefault(commit.author, list()).append(commit.sha1)
+    for path in SecondaryIndex.top_paths(commit.info):
+      self.paths.setdefault(path, list()).append(commit.sha1)
+
+
+class SearchIndex(object):
+  """Collects the listed commits to search by SHA-1 prefix, title and author."""
+
+  FILENAME = 'search.js'
+  TOKEN_MATCHER = re.compile(r'[0-9a-z]{2,}')
+
+  def __init__(self):
+    self.rows = list()
+    self.sha1s = dict()
+    self.tokens = dict()
+
+  def __contains__(self, sha1):
+    return sha1 in self.sha1s
+
+  def add(self, commit):
+    if commit.sha1 in self.sha1s:
+      return
+
+    row = len(self.rows)
+    self.sha1s[commit.sha1] = row
+    self.rows.append([commit.sha1, commit.title, commit.author])
+    for token in set(SearchIndex.TOKEN_MATCHER.findall(
+        ('%s %s' % (commit.title, commit.author)).lower())):
+      self.tokens.setdefault(token, list()).append(row)
+
+  def value(self):
+    return {
+      'rows': self.rows,
+      'sha1s': sorted([sha1, row] for sha1, row in self.sha1s.items()),
+      'tokens': sorted([token, rows] for token, rows in self.tokens.items())}
+
+  def dump(self, filename):
+    with AtomicFile(filename) as fp:
+      fp.write('window.KREP_SEARCH = %s;\n' % json.dumps(
+        self.value(), separators=(',', ':')))
+
+
 class GitDiffSubcmd(SubCommand):
   COMMAND = 'git-diff'
 
+  # the assets are shared with the cheapest way the file system supports
+  DEPLOY_STRATEGIES = ('reflink', 'hardlink', 'symlink', 'copy')
+  # ioctl number to clone a file on btrfs/xfs, _IOW(0x94, 9, int)
+  FICLONE = 0x40049409
+
   help_summary = 'Generate report of the git commits between two SHA-1s'
   help_usage = """\
 %prog [options] SHA-1 [SHA-1] ...
@@ -171,6 +627,73 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
       dest='gitiles', action='store_true',
       help='Enable gitiles links within the SHA-1')
 
+    options.add_option(
+      '--secondary-index',
+      dest='secondary_index', action='store_true',
+      help='Generate the pages indexing the commits by author and by '
+           'top-level path, linked to their rows in the report')
+    options.add_option(
+      '--search-index',
+      dest='search_index', action='store_true',
+      help='Generate the index to search the commits on the report page')
+    options.add_option(
+      '--compact',
+      dest='compact', action='store_true',
+      help='Embed the rows as data to build the tables in the browser')
+    options.add_option(
+      '--change-id',
+      dest='change_id', action='store_true',
+      help='List the gerrit changes with the Change-Id of the commits')
+    options.add_option(
+      '--change-refs',
+      dest='change_refs', action='store_true',
+      help='Look up the change numbers in the local refs/changes either')
+
+    options = optparse.add_option_group('Memory options')
+    options.add_option(
+      '--memory-budget',
+      dest='memory_budget', action='store', type='int',
+      help='Set the megabytes of the commit details and lists kept in '
+           'memory, the others are spilled to a temporary file')
+    options.add_option(
+      '--delta-from',
+      dest='delta_from', action='store',
+      help='Generate the page of the commits added and removed since the '
+           'snapshot of a previous run')
+
+    options = optparse.add_option_group('Range options')
+    options.add_option(
+      '--single-walk',
+      dest='single_walk', action='store_true',
+      help='With one SHA-1, walk the history once instead of diffing from '
+           'every root commit and label the commits with their roots, the '
+           'labels are taken from the whole history with --since and '
+           '--max-depth')
+    options.add_option(
+      '--since',
+      dest='since', action='store',
+      help='Only list the commits more recent than the date with one SHA-1')
+    options.add_option(
+      '--max-depth',
+      dest='max_depth', action='store', type='int',
+      help='Only list the number of commits with one SHA-1')
+    options.add_option(
+      '--ref-jobs',
+      dest='ref_jobs', action='store', type='int', default=1,
+      help='Set the threads to walk the ranges of a repository and fetch '
+           'the commit details, default: %default')
+
+    options = optparse.add_option_group('Debug options')
+    options.add_option(
+      '--trace',
+      dest='trace', action='store',
+      help='Dump the git calls and phase timings into the file')
+    options.add_option(
+      '--trace-format',
+      dest='trace_format', action='store', default=DiffTrace.FORMAT_JSON,
+      type='choice', choices=(DiffTrace.FORMAT_JSON, DiffTrace.FORMAT_CHROME),
+      help='Set the format of the trace file, default: %default')
+
   def execute(self, options, *args, **kws):
     SubCommand.execute(self, options, *args, **kws)
 
@@ -178,6 +701,11 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
       RaiseExceptionIfOptionMissed(
         options.remote, "remote need set for gitiles")
 
+    try:
+      from urllib.parse import urlparse
+    except ImportError:
+      from urlparse import urlparse
+
     name, remote = None, options.remote
     project = GitProject(None, worktree=options.working_dir)
 
@@ -195,15 +723,71 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
       if ulp.port:
         remote += ':%d' % ulp.port
 
+    name = options.name or name or ''
+    trace = DiffTrace(enabled=bool(options.trace))
     pattern = GitDiffSubcmd.get_patterns(options)  # pylint: disable=E1101
-    GitDiffSubcmd.generate_report(
-      args, project,
-      options.name or name or '', options.output, options.output,
-      pattern, remote, options.gitiles, options.gen_no_merge)
+    # keep the snapshot of a cached report from the previous run
+    filename = os.path.join(options.output, Snapshot.FILENAME)
+    snapshot = Snapshot.load(filename)
+    spill = GitDiffSubcmd.spill_store(options)
+    try:
+      GitDiffSubcmd.generate_report(
+        args, project, name, options.output, options.output,
+        pattern, remote, options.gitiles, options.gen_no_merge, trace=trace,
+        single_walk=options.single_walk,
+        walk_options=GitDiffSubcmd.walk_options(options),
+        secondary=options.secondary_index, search=options.search_index,
+        ref_jobs=options.ref_jobs, snapshot=snapshot, compact=options.compact,
+        spill=spill, changes=GitDiffSubcmd.change_mode(options))
+    finally:
+      if spill is not None:
+        spill.close()
+
+    snapshot.retain((name,))
+    snapshot.dump(filename)
+    if options.delta_from:
+      GitDiffSubcmd.generate_delta(
+        options.output, Snapshot.load(options.delta_from), snapshot,
+        {name: project}, remote, options.gitiles)
+
+    if options.trace:
+      trace.dump(options.trace, options.trace_format)
+
+  @staticmethod
+  def _reflink(origin, target):
+    import fcntl  # pylint: disable=E0401
+
+    with open(origin, 'rb') as src:
+      with open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), GitDiffSubcmd.FICLONE, src.fileno())
+
+  @staticmethod
+  def share_file(origin, target):
+    for strategy in GitDiffSubcmd.DEPLOY_STRATEGIES:
+      try:
+        if strategy == 'reflink':
+          GitDiffSubcmd._reflink(origin, target)
+        elif strategy == 'hardlink':
+          os.link(origin, target)
+        elif strategy == 'symlink':
+          # the origin might be relative to the working directory
+          os.symlink(os.path.abspath(origin), target)
+        else:
+          import shutil
+
+          shutil.copyfile(origin, target)
+
+        return strategy
+      except (AttributeError, ImportError, IOError, OSError):
+        # drop the partial file left by a failed strategy
+        if os.path.lexists(target):
+          os.unlink(target)
+
+    raise IOError('failed to deploy %s to %s' % (origin, target))
 
   @staticmethod
   @synchronized
-  def deploy(script, root, refer):
+  def deploy(script, root, refer, quiet=False):
     origin = os.path.realpath(
       '%s/../%s' % (os.path.dirname(__file__), script))
     target = os.path.join(root, script)
@@ -212,11 +796,55 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
       dirname = os.path.dirname(target)
       if not os.path.exists(dirname):
         os.makedirs(dirname)
+      elif os.path.lexists(target):
+        # the link is left dangling once the plug-ins moved
+        os.unlink(target)
 
-      shutil.copyfile(origin, target)
+      strategy = GitDiffSubcmd.share_file(origin, target)
+      if not quiet:
+        print('Deploy %s with %s' % (target, strategy))
 
     return os.path.relpath(target, refer)
 
+  @staticmethod
+  @contextlib.contextmanager
+  def open_page(filename, title, root, output, scripts=(), quiet=False):
+    """Writes the head, the navigation bar and the scripts of a page."""
+    with FormattedFile.open(filename) as outfile:
+      with outfile.head() as head:
+        head.meta(charset='utf-8')
+        head.title(title)
+
+        head.comment(' Boot strap core CSS ')
+        head.link(
+          href=GitDiffSubcmd.deploy(
+            'asserts/css/bootstrap.min.css', root, output, quiet),
+          rel='stylesheet')
+        head.link(
+          href=GitDiffSubcmd.deploy(
+            'asserts/css/krep-diff.css', root, output, quiet),
+          rel='stylesheet')
+
+      with outfile.body() as bd:
+        with bd.nav(clazz="nav navbar-dark bg-dark") as nav:
+          with nav.wbutton(clazz="navbar-toggler", type="button") as bnav:
+            bnav.span('', clazz="navbar-toggler-icon")
+
+        yield bd
+
+        bd.script(
+          "window.jQuery || document.write('<script src=\"%s\">"
+          "<\/script>')" % GitDiffSubcmd.deploy(
+            'asserts/js/vendor/jquery-slim.min.js', root, output, quiet),
+          _escape=False)
+        # write an empty string to keep <script></script> to make js working
+        bd.script(
+          '',
+          src=GitDiffSubcmd.deploy(
+            'asserts/js/bootstrap.min.js', root, output, quiet))
+        for script in scripts:
+          bd.script('', src=script)
+
   @staticmethod
   def time_diff(tia, tib):
     out = ''
@@ -240,13 +868,113 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
 
     return out
 
+  @staticmethod
+  def _git_cwd(project):
+    # only take the string attributes as the project may treat the unknown
+    # attributes as git commands
+    for attr in ('worktree', 'gitdir', 'path'):
+      value = getattr(project, attr, None)
+      if isinstance(value, str) and os.path.isdir(value):
+        return value
+
+    return None
+
+  @staticmethod
+  def spool_git(project, *args):
+    import subprocess
+    import tempfile
+
+    cwd = GitDiffSubcmd._git_cwd(project)
+    if cwd is None:
+      return None, None
+
+    spool = tempfile.TemporaryFile()
+    with open(os.devnull, 'w') as devnull:
+      with DiffTrace.git_timing(project, args[0].replace('-', '_')):
+        # the commit-graph is read by default since git 2.24 only
+        ret = subprocess.call(
+          ['git', '-c', 'core.commitGraph=true'] + list(args),
+          cwd=cwd, stdout=spool, stderr=devnull)
+
+    spool.seek(0)
+    return ret, spool
+
+  @staticmethod
+  def iter_records(spool, fixed=False):
+    """Yields the lines of the spool, cut by the width of the first if fixed."""
+    import mmap
+
+    size = os.fstat(spool.fileno()).st_size
+    if not size:
+      return
+
+    mm = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      width = mm.find(b'\n') if fixed else -1
+      offset = 0
+      while offset < size:
+        end = offset + width
+        if width < 0 or (end < size and mm[end:end + 1] != b'\n'):
+          end = mm.find(b'\n', offset)
+          if end < 0:
+            end = size
+
+        sha1 = mm[offset:end]
+        if sha1:
+          yield sha1 if isinstance(sha1, str) else sha1.decode('ascii')
+
+        offset = end + 1
+    finally:
+      mm.close()
+
+  @staticmethod
+  def walk_options(options):
+    args = list()
+    if options.since:
+      args.append('--since=%s' % options.since)
+    if options.max_depth:
+      args.append('--max-count=%d' % options.max_depth)
+
+    return args
+
+  @staticmethod
+  def change_mode(options):
+    if options.change_refs:
+      return 'refs'
+    elif options.change_id:
+      return 'id'
+    else:
+      return None
+
+  @staticmethod
+  def spill_store(options):
+    if options.memory_budget:
+      return SpillStore(options.memory_budget * 1024 * 1024)
+    else:
+      return None
+
+  @staticmethod
+  def range_name(sref, eref):
+    if sref:
+      return '%s..%s' % (sref, eref)
+    else:
+      return eref
+
   @staticmethod
   def get_commits(project, sref, eref, *options):
     args = list()
     if len(options) > 0:
         args.extend(options)
     args.append('--pretty=%H')
-    args.append('%s..%s' % (sref, eref))
+    args.append(GitDiffSubcmd.range_name(sref, eref))
+
+    ret, spool = GitDiffSubcmd.spool_git(project, 'log', *args)
+    if spool is not None:
+      with spool:
+        if ret == 0:
+          return list(GitDiffSubcmd.iter_records(spool, fixed=True))
+        else:
+          return list()
 
     ret, sha1s = project.log(*args)
     if ret == 0:
@@ -260,6 +988,184 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
     else:
       return list()
 
+  @staticmethod
+  def get_classified_commits(project, sref, eref, *options):
+    """Lists the commits and the ones without merge with a single walk."""
+    args = list(options)
+    args.append('--parents')
+    args.append(GitDiffSubcmd.range_name(sref, eref))
+
+    ret, spool = GitDiffSubcmd.spool_git(project, 'rev-list', *args)
+    if spool is None:
+      return GitDiffSubcmd.get_commits(project, sref, eref, *options), \
+        GitDiffSubcmd.get_commits(project, sref, eref, '--no-merges', *options)
+
+    sha1s, no_merges = list(), list()
+    with spool:
+      if ret == 0:
+        for line in GitDiffSubcmd.iter_records(spool):
+          # sha-1 followed by one parent at most is not a merge
+          sha1 = line[:line.find(' ')] if ' ' in line else line
+          sha1s.append(sha1)
+          if line.count(' ') < 2:
+            no_merges.append(sha1)
+
+    return sha1s, no_merges
+
+  @staticmethod
+  def count_commits(project, sref, eref):
+    ret, count = project.rev_list(
+      '--count', '--use-bitmap-index', GitDiffSubcmd.range_name(sref, eref))
+    if ret == 0 and count.strip('"\n').isdigit():
+      return int(count.strip('"\n'))
+    else:
+      return None
+
+  @staticmethod
+  def objects_dir(project):
+    cwd = GitDiffSubcmd._git_cwd(project)
+    if cwd is None:
+      return None
+
+    ret, objects = project.rev_parse('--git-path', 'objects')
+    if ret != 0:
+      return None
+
+    return os.path.realpath(os.path.join(cwd, objects.strip('"\n')))
+
+  @staticmethod
+  def object_store(project):
+    objects = GitDiffSubcmd.objects_dir(project)
+    if objects is None:
+      return None
+
+    # the forks borrowing the objects share the store of the alternate
+    alternates = os.path.join(objects, 'info', 'alternates')
+    if os.path.exists(alternates):
+      with open(alternates, 'r') as fp:
+        for line in fp:
+          line = line.strip()
+          if line and not line.startswith('#'):
+            return os.path.realpath(os.path.join(objects, line))
+
+    return objects
+
+  @staticmethod
+  def graph_features(project):
+    features = set()
+
+    objects = GitDiffSubcmd.objects_dir(project)
+    if objects is None:
+      return features
+
+    if os.path.exists(os.path.join(objects, 'info', 'commit-graph')) or \
+        os.path.isdir(os.path.join(objects, 'info', 'commit-graphs')):
+      features.add('commit-graph')
+    if glob.glob(os.path.join(objects, 'pack', '*.bitmap')):
+      features.add('bitmap')
+
+    return features
+
+  @staticmethod
+  def prepare_graph(project, bitmap=False, name=None):
+    name = name or project
+    features = GitDiffSubcmd.graph_features(project)
+    if 'commit-graph' not in features:
+      ret, _ = project.commit_graph('write', '--reachable')
+      if ret != 0:
+        print('Failed to write the commit-graph of %s' % name)
+
+    if bitmap and 'bitmap' not in features:
+      # the repack would copy the borrowed objects and the bitmap can't
+      # cover the objects left in the alternate
+      if GitDiffSubcmd.object_store(project) != \
+          GitDiffSubcmd.objects_dir(project):
+        print('Skip the bitmap of %s borrowing the objects' % name)
+        return
+
+      ret, _ = project.repack('-a', '-d', '-l', '-b')
+      if ret != 0:
+        print('Failed to repack %s with the bitmap' % name)
+
+  @staticmethod
+  def label_roots(project, eref, roots, *options):
+    roots = set(roots)
+    labels, interned = dict(), dict()
+
+    def _label(line):
+      sha1s = line.split()
+      if sha1s:
+        label = set()
+        if sha1s[0] in roots:
+          label.add(sha1s[0])
+        for parent in sha1s[1:]:
+          label.update(labels.get(parent, ()))
+
+        # commits on the same line of history share the same label
+        label = frozenset(label)
+        labels[sha1s[0]] = interned.setdefault(label, label)
+
+    # parents are listed ahead of their children with the reversed order
+    args = ['--parents', '--topo-order', '--reverse']
+    args.extend(options)
+    args.append(eref)
+
+    ret, spool = GitDiffSubcmd.spool_git(project, 'rev-list', *args)
+    if spool is not None:
+      with spool:
+        if ret == 0:
+          for line in GitDiffSubcmd.iter_records(spool):
+            _label(line)
+    else:
+      ret, lines = project.rev_list(*args)
+      if ret == 0:
+        for line in lines.split('\n'):
+          _label(line.strip('"'))
+
+    return labels
+
+  @staticmethod
+  def walk_union(project, sref, erefs):
+    """Lists the ranges from the base to the ends with a single walk."""
+    walked = dict((eref, (list(), list())) for eref in erefs)
+    reach, interned = dict(), dict()
+
+    def _walk(line):
+      sha1s = line.split()
+      if sha1s:
+        ends = reach.pop(sha1s[0], frozenset())
+        if sha1s[0] in walked:
+          ends = ends.union((sha1s[0],))
+
+        for eref in ends:
+          walked[eref][0].append(sha1s[0])
+          if len(sha1s) < 3:
+            walked[eref][1].append(sha1s[0])
+
+        # the parents are reached by the ends reaching their children
+        for parent in sha1s[1:]:
+          label = reach.get(parent, frozenset()).union(ends)
+          reach[parent] = interned.setdefault(label, label)
+
+    # children are listed ahead of their parents with the date order
+    args = ['--parents', '--date-order']
+    args.extend(walked)
+    args.append('^%s' % sref)
+
+    ret, spool = GitDiffSubcmd.spool_git(project, 'rev-list', *args)
+    if spool is not None:
+      with spool:
+        if ret == 0:
+          for line in GitDiffSubcmd.iter_records(spool):
+            _walk(line)
+    else:
+      ret, lines = project.rev_list(*args)
+      if ret == 0:
+        for line in lines.split('\n'):
+          _walk(line.strip('"'))
+
+    return walked if ret == 0 else None
+
   @staticmethod
   def get_commit_detail(project, sha1):
     vals = list()
@@ -300,13 +1206,132 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
 
     return details.get(sha1)
 
+  @staticmethod
+  def filter_commits(project, details, pattern, logs, no_merged_logs):
+    filtered_logs = list()
+    filtered_no_merged_logs = list()
+    if pattern:
+      for li in logs:
+        ci = GitDiffSubcmd.get_commit_ci(project, details, li)
+        if pattern.match('e,email', ci.committer):
+          filtered_logs.append(li)
+          if li in no_merged_logs:
+            filtered_no_merged_logs.append(li)
+
+    return filtered_logs, filtered_no_merged_logs
+
+  @staticmethod
+  def collect_ranges(
+      project, name, ranges, erefs, details, pattern, trace=None,
+      walk_options=None, jobs=1, spill=None, listed=None, indexes=(),
+      walked=None):
+    """Collects the commits of the ranges with their details."""
+    if trace is None:
+      trace = DiffTrace(enabled=False)
+
+    walk_options = walk_options or list()
+
+    def _walk(ref):
+      # the ranges walked ahead aren't walked again
+      if walked and ref in walked:
+        return walked[ref]
+
+      return GitDiffSubcmd.get_classified_commits(
+        project, ref, erefs, *walk_options)
+
+    def _detail(sha1):
+      return GitDiffSubcmd.get_commit_detail(project, sha1)
+
+    pool = None
+    if jobs and jobs > 1:
+      from multiprocessing.pool import ThreadPool
+
+      pool = ThreadPool(jobs)
+
+    counts = Result()
+    persists = dict()
+    charged = 0
+    try:
+      if pool:
+        walks = pool.imap(_walk, ranges)
+      else:
+        walks = (_walk(ref) for ref in ranges)
+
+      for ref, (full_logs, full_no_merged_logs) in zip(ranges, walks):
+        # the details of the commits shared by the ranges are fetched once
+        pending = [sha1 for sha1 in full_logs if sha1 not in details]
+        if pool:
+          commits = pool.imap(_detail, pending)
+        else:
+          commits = (_detail(sha1) for sha1 in pending)
+
+        for sha1, commit in zip(pending, commits):
+          details.put(sha1, commit)
+
+        pending = None
+        if listed is not None:
+          size = len(listed)
+          for sha1 in full_logs:
+            if sha1 not in listed:
+              listed.add(sha1)
+              if indexes and sha1 in details:
+                commit = details.get(sha1)
+                for index in indexes:
+                  index.add(commit)
+
+          if spill is not None:
+            # the set isn't spilled but takes the budget to spill the others
+            size = 64 * (len(listed) - size)
+            spill.reserve(size)
+            charged += size
+
+        counts.update(
+          full=len(full_logs), no_merge=len(full_no_merged_logs),
+          increase=True)
+
+        with trace.phase(name, 'filter'):
+          filtered_logs, filtered_no_merged_logs = \
+            GitDiffSubcmd.filter_commits(
+              project, details, pattern, full_logs, full_no_merged_logs)
+        counts.update(
+          filter=len(filtered_logs),
+          filter_no_merge=len(filtered_no_merged_logs), increase=True)
+
+        persists[ref] = Persist(
+          None, full_logs, full_no_merged_logs, filtered_logs,
+          filtered_no_merged_logs)
+        if spill is not None:
+          charged += persists[ref].spill(spill)
+    except Exception:
+      # nothing is returned to be released by the caller
+      if spill is not None:
+        spill.release(charged)
+      raise
+    finally:
+      if pool:
+        pool.close()
+        pool.join()
+
+    return persists, counts, charged
+
   @staticmethod
   def update_table(
       accord, details, logs, id, title, remote=None,
-      name=None, gitiles=True):
+      name=None, gitiles=True, labels=None, search=None, compact=False,
+      changes=None, anchors=None):
     tid = 'div_%d' % id
     hid = 'header_%d' % id
 
+    # the compact rows are built by krep-table.js from the embedded payload
+    attrs, rows = dict(), list()
+    if compact:
+      attrs = {
+        'clazz': 'table table-hover table-striped krep-compact',
+        'data_rows': 'rows_%d' % id, 'data_remote': remote or '',
+        'data_name': name or '', 'data_gitiles': int(bool(gitiles)),
+        'data_roots': int(labels is not None),
+        'data_changes': int(changes is not None)}
+
     with accord.div(clazz='card w-95', id='entire_%d' % id) as dcard:
       with dcard.div('%s ' % title, clazz='card-header', id=hid) as dhd:
         dhd.span(len(logs), clazz='badge badge-info',
@@ -317,15 +1342,49 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
           clazz='collapse show', id=tid, aria_labelledby=hid,
           data_parent='#%s' % tid) as cont:
         with cont.div(clazz='card-body') as cbd:
-          with cbd.table(clazz='table table-hover table-striped') as table:
+          with cbd.table(
+              clazz=attrs.pop('clazz', 'table table-hover table-striped'),
+              **attrs) as table:
             with table.tr() as tr:
               tr.th('SHA-1', scope='col')
               tr.th('Date', scope='col')
               tr.th('Author', scope='col')
               tr.th('Title', scope='col')
+              if labels is not None:
+                tr.th('Roots', scope='col')
+              if changes is not None:
+                tr.th('Change', scope='col')
 
             for sha1 in logs:
-              with table.tr() as tr:
+              if sha1 in details:
+                commit = details.get(sha1)
+              else:
+                commit = CommitInfo(
+                  sha1, '-', 'Unknown', 'Unknown', 'Unknown', '')
+
+              # the commit is anchored at its first row to be searched and
+              # linked from the secondary pages
+              kws = dict()
+              if anchors is not None and sha1 not in anchors:
+                kws['id'] = 'sha1-%s' % sha1
+                anchors.add(sha1)
+                if search is not None:
+                  search.add(commit)
+
+              if compact:
+                rows.append([
+                  sha1, re.split(' [+-]', commit.date)[0], commit.author,
+                  commit.title, commit.info or '',
+                  int(details.is_reverted(sha1)) | (2 if kws else 0)])
+                if labels is not None:
+                  rows[-1].append(', '.join(sorted(
+                    root[:10] for root in labels.get(sha1, ()))))
+                if changes is not None:
+                  rows[-1].append(list(changes.get(commit)))
+
+                continue
+
+              with table.tr(**kws) as tr:
                 reverted = details.is_reverted(sha1)
                 with tr.wtd() as td:
                   if name:
@@ -365,12 +1424,6 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
                     else:
                       td.pre(sha1)
 
-                if sha1 in details:
-                  commit = details.get(sha1)
-                else:
-                  commit = CommitInfo(
-                    sha1, '-', 'Unknown', 'Unknown', 'Unknown', '')
-
                 date = re.split(' [+-]', commit.date)[0] # ignore timezone
                 if reverted:
                   with tr.wtd() as td:
@@ -397,12 +1450,45 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
                   else:
                     tr.td(commit.title, clazz='align-middle')
 
+                if labels is not None:
+                  tr.td(
+                    ', '.join(sorted(root[:10] for root in labels.get(
+                      sha1, ()))), clazz='align-middle')
+
+                if changes is not None:
+                  number, change_id = changes.get(commit)
+                  if number and remote:
+                    with tr.wtd(clazz='align-middle') as td:
+                      td.a(number, href='%s/#/c/%d/' % (remote, number))
+                  elif change_id and remote:
+                    with tr.wtd(clazz='align-middle') as td:
+                      td.a(
+                        change_id[:10], href='%s/#/q/%s' % (
+                          remote, change_id), title=change_id)
+                  else:
+                    tr.td(
+                      number or (change_id or '')[:10], clazz='align-middle')
+
+          if compact:
+            # keep the payload from closing the script element or opening
+            # a comment in it, the escapes are decoded by JSON.parse
+            payload = json.dumps(rows, separators=(',', ':')).replace(
+              '<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+            cbd.script(
+              payload, type='application/json', id='rows_%d' % id,
+              _escape=False)
+
   @staticmethod
-  def generate_report(  # pylint: disable=R0915
-      args, project, name, root, output, # pylint: disable=W0622
-      pattern, remote=None, gitiles=True, gen_no_merge=False, results=None,
-      quiet=False):
+  def collect_report(
+      args, project, name, pattern, trace, single_walk=False,
+      walk_options=None, details=None, stats=None, secondary=False,
+      ref_jobs=1, snapshot=None, spill=None, walked=None):
+    """Collects the ranges of a report, None if nothing is in between."""
     def _secure_sha(gitp, refs):
+      # the resolved sha-1 needn't be parsed again
+      if re.match(r'^[0-9a-f]{40}$', refs):
+        return refs
+
       ret, sha1 = gitp.rev_parse(refs)
       if ret == 0:
         return sha1
@@ -413,17 +1499,8 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
         else:
           return ''
 
-    start = time.time()
-    if not os.path.exists(output):
-      os.makedirs(output)
-
-    result = Result(remote, filename=os.path.join(output, 'result.json'))
-    if result.count():
-      results[name] = result
-      return
-
-    num = 0
     brefs = list()
+    labels = None
     if len(args) < 2:
       if len(args) == 0:
         print('No SHA-1 provided, use HEAD by default')
@@ -432,38 +1509,248 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
       ret, head = project.rev_list('--max-parents=0', erefs)
       if ret == 0:
         brefs.extend(head.split('\n'))
+
+      # the labels come from the whole history as the limited walk would
+      # miss the roots, only the listing is limited
+      if single_walk and len(brefs) > 1:
+        labels = GitDiffSubcmd.label_roots(project, erefs, brefs)
+        # list the commits in the order of the labelling walk
+        walk_options = ['--topo-order'] + list(walk_options or [])
     else:
+      walk_options = None
       erefs = _secure_sha(project, args[1])
       brefs.append(_secure_sha(project, args[0]))
-      # if two sha-1s are equaling, return
+      # if two sha-1s are equaling or nothing is in between, return, the
+      # range is only counted ahead with the bitmaps not to walk it twice
       if erefs == brefs[-1]:
-        if results:
+        return None
+      elif walked is not None:
+        if not walked[0]:
+          return None
+      elif 'bitmap' in GitDiffSubcmd.graph_features(project) and \
+          GitDiffSubcmd.count_commits(project, brefs[-1], erefs) == 0:
+        return None
+
+    owned = details is None
+    if owned:
+      details = Details(spill)
+
+    charged = 0
+    try:
+      if spill is not None and labels:
+        # the labels aren't spilled but take the budget to spill the details
+        # and the lists earlier
+        charged = 64 * len(labels)
+        spill.reserve(charged)
+
+      # both the pages are rendered from the same collected ranges
+      ranges = [None] if labels is not None else brefs
+      secondary = SecondaryIndex() if secondary else None
+      # the listed commits are counted once though they're in more ranges
+      listed = None
+      if snapshot is not None or stats is not None or secondary is not None:
+        listed = set()
+
+      persists, counts, collected = GitDiffSubcmd.collect_ranges(
+        project, name, ranges, erefs, details, pattern, trace, walk_options,
+        ref_jobs, spill, listed,
+        [index for index in (stats, secondary) if index is not None],
+        None if walked is None else {brefs[-1]: walked})
+
+      charged += collected
+    except Exception:
+      if spill is not None:
+        spill.release(charged)
+      if owned:
+        details.close()
+      raise
+
+    def _release():
+      # the budget is given back once the pages are rendered
+      if spill is not None:
+        spill.release(charged)
+      if owned:
+        details.close()
+
+    return (
+      brefs, erefs, labels, persists, counts, listed, details, secondary,
+      _release)
+
+  @staticmethod
+  def generate_report(  # pylint: disable=R0915
+      args, project, name, root, output, # pylint: disable=W0622
+      pattern, remote=None, gitiles=True, gen_no_merge=False, results=None,
+      quiet=False, trace=None, single_walk=False, walk_options=None,
+      details=None, stats=None, secondary=False, search=False, store=None,
+      ref_jobs=1, snapshot=None, compact=False, spill=None, changes=None,
+      collected=None, publish=None, walked=None):
+    start = time.time()
+    if not os.path.exists(output):
+      os.makedirs(output)
+    # the temporary files of the interrupted runs are never published
+    AtomicFile.cleanup(output)
+
+    if trace is None:
+      trace = DiffTrace(enabled=False)
+
+    project = trace.wrap(name, project)
+
+    if store is not None:
+      result = Result(remote, store=store, name=name)
+    else:
+      result = Result(remote, filename=os.path.join(output, 'result.json'))
+    if result.count():
+      # the statistics of the cached report are kept in the store
+      if stats is not None and store is not None:
+        stats.merge(Statistics.load(store.get_stats(name)))
+      if results is not None:
+        results[name] = result
+      return
+
+    shared = collected is not None
+    if not shared:
+      collected = GitDiffSubcmd.collect_report(
+        args, project, name, pattern, trace, single_walk, walk_options,
+        details, stats, secondary, ref_jobs, snapshot, spill, walked)
+      if collected is None:
+        if snapshot is not None:
+          snapshot.add(name, ())
+        if results is not None:
           result.dump()
           results[name] = result
 
         return
 
-    details = Details()
-    GitDiffSubcmd._generate_html(
-      brefs, erefs, args, project, name, root, output,
-      os.path.join(output, 'index.html'),
-      pattern, remote, gitiles, details, gen_no_merge, results,
-      result=result, full=True)
+    brefs, erefs, labels, persists, counts, listed, details, secondary, \
+      release = collected
+    if shared:
+      # the ranges collected by another project are released by its owner
+      handed = True
+      if stats is not None and listed is not None:
+        for sha1 in listed:
+          if sha1 in details:
+            stats.add(details.get(sha1))
+    else:
+      handed = publish is not None and publish(collected)
 
-    GitDiffSubcmd._generate_html(
-      brefs, erefs, args, project, name, root, output,
-      os.path.join(output, 'filter.html'),
-      pattern, remote, gitiles, details, gen_no_merge, results, result=result)
+    try:
+      if snapshot is not None:
+        snapshot.add(name, listed)
+
+      if changes == 'refs':
+        changes = Changes().load(project)
+      elif changes:
+        changes = Changes()
+
+      GitDiffSubcmd._generate_html(
+        brefs, erefs, args, project, name, root, output,
+        os.path.join(output, 'index.html'),
+        pattern, remote, gitiles, details, gen_no_merge, results,
+        result=result, full=True, trace=trace, persists=persists,
+        counts=counts, labels=labels, secondary=secondary,
+        search=SearchIndex() if search else None, compact=compact,
+        changes=changes, quiet=quiet)
+
+      if secondary is not None:
+        with trace.phase(name, 'secondary'):
+          GitDiffSubcmd.generate_secondary(
+            secondary, name, root, output, quiet)
+
+      GitDiffSubcmd._generate_html(
+        brefs, erefs, args, project, name, root, output,
+        os.path.join(output, 'filter.html'),
+        pattern, remote, gitiles, details, gen_no_merge, results, result=result,
+        trace=trace, persists=persists, counts=counts, labels=labels,
+        compact=compact, changes=changes, quiet=quiet)
+    finally:
+      # the budget is given back even if the pages failed
+      if not handed:
+        release()
 
     result.dump()
+    if stats is not None and store is not None:
+      store.put_stats(name, stats.value())
+    trace.count(name, 'commits', len(details))
+    trace.record(name, 'phases', 'report', start, time.time())
     if not quiet:
         print('Totally cost: %s' % GitDiffSubcmd.time_diff(time.time(), start))
 
+  @staticmethod
+  def generate_delta(
+      output, previous, current, projects, remote=None, gitiles=True):
+    """Generates the commits added and removed since the previous snapshot."""
+    if remote:
+      remote = remote.rstrip('/')
+
+    delta = current.delta(previous)
+    with open(os.path.join(output, 'delta.json'), 'w') as fp:
+      json.dump(
+        dict((name, {'added': sorted(added), 'removed': sorted(removed)})
+             for name, (added, removed) in delta.items()),
+        fp, indent=2, sort_keys=True)
+
+    with GitDiffSubcmd.open_page(
+        os.path.join(output, 'delta.html'), 'Delta of Logs', output,
+        output) as bd:
+      bd.p()
+      with bd.div(id='accordion') as acc:
+        index = 1
+        for name in sorted(delta):
+          details = Details()
+          project = projects.get(name)
+          for title, sha1s in zip(('Added to', 'Removed from'), delta[name]):
+            if not sha1s:
+              continue
+
+            if project is not None:
+              for sha1 in sha1s:
+                GitDiffSubcmd.get_commit_ci(project, details, sha1)
+
+            # list the recent commits first
+            logs = sorted(
+              sha1s, key=lambda sha1: (
+                details.get(sha1).date if sha1 in details else '', sha1),
+              reverse=True)
+            GitDiffSubcmd.update_table(
+              acc, details, logs, index, '%s %s' % (title, name), remote,
+              name, gitiles)
+            index += 1
+
+  @staticmethod
+  def generate_secondary(secondary, name, root, output, quiet=False):
+    for item, page in SecondaryIndex.PAGES:
+      index = getattr(secondary, item)
+      if not index:
+        continue
+
+      with GitDiffSubcmd.open_page(
+          os.path.join(output, page), 'Logs of %s by %s' % (name, item),
+          root, output, quiet=quiet) as bd:
+        # the commits are linked to their rows in the index page
+        bd.p()
+        with bd.div(clazz='card w-95') as pdiv:
+          with pdiv.div(clazz='card-body') as cbd:
+            with cbd.table(clazz='table table-hover table-striped') as table:
+              for key in sorted(index):
+                with table.tr() as tr:
+                  with tr.wtd(_nowrap=True) as td:
+                    td.write('%s ' % key)
+                    td.span(len(index[key]), clazz='badge badge-info')
+                  with tr.wtd() as td:
+                    for sha1 in index[key]:
+                      td.a(sha1[:10], href='index.html#sha1-%s' % sha1)
+                      td.write(' ')
+
   @staticmethod
   def _generate_html(  # pylint: disable=R0915
       brefs, erefs, args, project, name, root, output, filename,  # pylint: disable=W0622
       pattern, remote=None, gitiles=True, details=None, gen_no_merge=False,
-      results=None, result=None, full=False):
+      results=None, result=None, full=False, trace=None, persists=None,
+      counts=None, labels=None, secondary=None, search=None, compact=False,
+      changes=None, quiet=False):
+
+    if trace is None:
+      trace = DiffTrace(enabled=False)
 
     if remote:
       remote = remote.rstrip('/')
@@ -472,161 +1759,150 @@ gerrit server which can provide a query of the commit if gerrit is enabled."""
     if res is None:
       res = Result(remote)
 
-    with FormattedFile.open(filename) as outfile:
-      with outfile.head() as head:
-        head.meta(charset='utf-8')
-        head.title('Logs of %s' % name)
-
-        head.comment(' Boot strap core CSS ')
-        head.link(
-          href=GitDiffSubcmd.deploy(
-            'asserts/css/bootstrap.min.css', root, output),
-          rel='stylesheet')
-        head.link(
-          href=GitDiffSubcmd.deploy(
-            'asserts/css/krep-diff.css', root, output),
-          rel='stylesheet')
-
-      with outfile.body() as bd:
-        with bd.nav(clazz="nav navbar-dark bg-dark") as nav:
-          with nav.wbutton(clazz="navbar-toggler", type="button") as bnav:
-            bnav.span('', clazz="navbar-toggler-icon")
-
-        counts = Result()
-        persists = dict()
-        for ref in brefs:
-          full_logs, _ = GitDiffSubcmd.get_commits_with_detail(
-            project, ref, erefs, details)
-          full_no_merged_logs = GitDiffSubcmd.get_commits(
-            project, ref, erefs, '--no-merges')
-
-          counts.update(
-            full=len(full_logs), no_merge=len(full_no_merged_logs),
-            increase=True)
-
-          filtered_logs = list()
-          filtered_no_merged_logs = list()
-          if pattern:
-            for li in full_logs:
-              ci = GitDiffSubcmd.get_commit_ci(project, details, li)
-              if pattern.match('e,email', ci.committer):
-                filtered_logs.append(li)
-                counts.update(filter=len(filtered_logs), increase=True)
-
-                if li in full_no_merged_logs:
-                  filtered_no_merged_logs.append(li)
-                  counts.update(
-                    filter_no_merge=len(filtered_no_merged_logs),
-                    increase=True)
-
-          persists[ref] = Persist(
-            full_logs, full_no_merged_logs, filtered_logs,
-            filtered_no_merged_logs)
-
-        bd.p()
-        with bd.div(clazz='card w-75') as bdiv:
-          with bdiv.div(clazz='card-block') as block:
-            with block.table(clazz='table') as btb:
-              for title, refss in (
-                  ('Start Refs', brefs), ('End Refs', [erefs])):
-                with btb.tr() as tr:
-                  tr.td(title, clazz='table-active', scope='row')
-
-                  with tr.wtd(_nowrap=True) as td:
-                    for m, ref in enumerate(refss):
-                      if m:
-                        td.br()
-
-                      if gitiles:
-                        td.a(
-                          ref,
-                          href='%s/plugins/gitiles/%s/+/%s^!' %
-                            (remote, name, ref))
-                      else:
-                        td.write(ref)
-
-                      # avaiable in 1.7.10
-                      ret, tags = project.tag('--points-at', ref)
-                      if ret == 0 and tags.strip():
-                        td.write(' (')
-                        for k, tag in enumerate(tags.split('\n')):
-                          if k > 0:
-                            td.write(', ')
+    scripts = list()
+    if compact:
+      scripts.append(GitDiffSubcmd.deploy(
+        'asserts/js/krep-table.js', root, output, quiet))
+    if search is not None:
+      scripts.append(SearchIndex.FILENAME)
+      scripts.append(GitDiffSubcmd.deploy(
+        'asserts/js/krep-search.js', root, output, quiet))
+
+    # the rows are anchored for the search and the secondary pages
+    anchors = None
+    if search is not None or secondary is not None:
+      anchors = set()
+
+    with GitDiffSubcmd.open_page(
+        filename, 'Logs of %s' % name, root, output, scripts, quiet) as bd:
+      # walk the history once for all the roots if labeled
+      ranges = [None] if labels is not None else brefs
+
+      bd.p()
+      with bd.div(clazz='card w-75') as bdiv:
+        with bdiv.div(clazz='card-block') as block:
+          with block.table(clazz='table') as btb:
+            for title, refss in (
+                ('Start Refs', brefs), ('End Refs', [erefs])):
+              with btb.tr() as tr:
+                tr.td(title, clazz='table-active', scope='row')
+
+                with tr.wtd(_nowrap=True) as td:
+                  for m, ref in enumerate(refss):
+                    if m:
+                      td.br()
+
+                    if gitiles:
+                      td.a(
+                        ref,
+                        href='%s/plugins/gitiles/%s/+/%s^!' %
+                          (remote, name, ref))
+                    else:
+                      td.write(ref)
+
+                    # avaiable in 1.7.10
+                    ret, tags = project.tag('--points-at', ref)
+                    if ret == 0 and tags.strip():
+                      td.write(' (')
+                      for k, tag in enumerate(tags.split('\n')):
+                        if k > 0:
+                          td.write(', ')
+
+                        if gitiles:
+                          td.a(
+                            tag,
+                            href='%s/plugins/gitiles/%s/+/%s' %
+                              (remote, name, tag))
+                        else:
+                          td.write(tag)
 
-                          if gitiles:
-                            td.a(
-                              tag,
-                              href='%s/plugins/gitiles/%s/+/%s' %
-                                (remote, name, tag))
-                          else:
-                            td.write(tag)
+                      td.write(')')
 
-                        td.write(')')
+            if secondary is not None:
+              with btb.tr() as tr:
+                tr.td('Indexes', clazz='table-active', scope='row')
+                with tr.wtd() as td:
+                  for item, page in SecondaryIndex.PAGES:
+                    td.a(
+                      item, href=page, clazz='badge badge-secondary')
 
+      if search is not None:
         bd.p()
-        with bd.div(id='accordion') as acc:
-          index = 1
-          # full log
-          if full and counts.full:
-            for ref in brefs:
-              logs = persists[ref].full
+        with bd.div(clazz='card w-75') as sdiv:
+          with sdiv.div(clazz='card-body') as sbd:
+            sbd.input(
+              id='krep-search', type='search', clazz='form-control',
+              placeholder='Search SHA-1, title or author')
+            with sbd.div('', id='krep-search-results'):
+              pass
+
+      bd.p()
+      with trace.phase(name, 'render'), bd.div(id='accordion') as acc:
+        index = 1
+        # full log
+        if full and counts.full:
+          for ref in ranges:
+            logs = persists[ref].full
+            if logs:
+              res.update(full=len(logs))
+              GitDiffSubcmd.update_table(
+                acc, details, logs, index,
+                'Logs of %s' % GitDiffSubcmd.range_name(ref, erefs),
+                remote, name, gitiles, labels, search, compact=compact,
+                changes=changes, anchors=anchors)
+              index += 1
+
+          # log with no merge
+          if gen_no_merge and counts.no_merge:
+            for ref in ranges:
+              logs = persists[ref].no_merge
               if logs:
-                res.update(full=len(logs))
+                res.update(no_merge=len(logs))
                 GitDiffSubcmd.update_table(
-                  acc, details, logs, index, 'Logs of %s..%s' % (ref, erefs),
-                  remote, name, gitiles)
+                  acc, details, logs, index,
+                  '%s (No merges)' % GitDiffSubcmd.range_name(ref, erefs),
+                  remote, name, gitiles, labels, search, compact=compact,
+                  changes=changes, anchors=anchors)
                 index += 1
 
-            # log with no merge
-            if gen_no_merge and counts.no_merge:
-              for ref in brefs:
-                logs = persists[ref].no_merge
-                if logs:
-                  res.update(no_merge=len(logs))
-                  GitDiffSubcmd.update_table(
-                    acc, details, logs, index,
-                    '%s..%s (No merges)' % (ref, erefs),
-                    remote, name, gitiles)
-                  index += 1
-
-          if pattern and counts.filter:
-            # full log with pattern
-            for ref in brefs:
-              logs = persists[ref].filter
+        if pattern and counts.filter:
+          # full log with pattern
+          for ref in ranges:
+            logs = persists[ref].filter
+            if logs:
+              res.update(filter=len(logs))
+              GitDiffSubcmd.update_table(
+                acc, details, logs, index,
+                'Filtered logs of %s' % GitDiffSubcmd.range_name(
+                  ref, erefs),
+                remote, name, gitiles, labels, compact=compact,
+                changes=changes)
+              index += 1
+
+          # log with pattern and no merge
+          if gen_no_merge and counts.filter_no_merge:
+            for ref in ranges:
+              logs = persists[ref].filter_no_merge
               if logs:
-                res.update(filter=len(logs))
+                res.update(filter_no_merge=len(logs))
                 GitDiffSubcmd.update_table(
                   acc, details, logs, index,
-                  'Filtered logs of %s..%s' % (ref, erefs),
-                  remote, name, gitiles)
+                  'Filtered logs of %s (No merges)' %
+                    GitDiffSubcmd.range_name(ref, erefs),
+                  remote, name, gitiles, labels, compact=compact,
+                  changes=changes)
                 index += 1
 
-            # log with pattern and no merge
-            if gen_no_merge and counts.filter_no_merge:
-              for ref in brefs:
-                logs = persists[ref].filtered_no_merged_logs
-                if logs:
-                  res.update(filter_no_merge=len(logs))
-                  GitDiffSubcmd.update_table(
-                    acc, details, logs, index,
-                    'Filtered logs of %s..%s (No merges)' % (ref, erefs),
-                    remote, name, gitiles)
-                  index += 1
-
-        bd.script(
-          "window.jQuery || document.write('<script src=\"%s\">"
-          "<\/script>')" % GitDiffSubcmd.deploy(
-            'asserts/js/vendor/jquery-slim.min.js', root, output),
-          _escape=False)
-        # write an empty string to keep <script></script> to make js working
-        bd.script(
-          '',
-          src=GitDiffSubcmd.deploy(
-            'asserts/js/bootstrap.min.js', root, output))
+      if search is not None:
+        search.dump(os.path.join(output, SearchIndex.FILENAME))
 
     # remove the generated file if all counts are zero
     if not res:
       os.unlink(filename)
+      if search is not None:
+        os.unlink(os.path.join(output, SearchIndex.FILENAME))
+    else:
+      trace.count(name, 'bytes', os.path.getsize(filename))
 
     if results is not None:
       orig = results.get(name, res)
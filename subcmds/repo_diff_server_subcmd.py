@@ -0,0 +1,295 @@
+
+import os
+import threading
+
+from collections import OrderedDict
+
+from git_diff_subcmd import GitDiffSubcmd, ResultStore
+from repo_diff_subcmd import ManifestIndex, RepoDiffSubcmd
+from topics import DiffTrace, RaiseExceptionIfOptionMissed
+
+
+class _PageCache(object):
+  """Keeps the recently served pages in memory up to the size."""
+
+  def __init__(self, size):
+    self.size = size
+    self.pages = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      page = self.pages.pop(key, None)
+      if page is not None:
+        self.pages[key] = page
+
+      return page
+
+  def put(self, key, page):
+    with self.lock:
+      self.pages.pop(key, None)
+      self.pages[key] = page
+      while len(self.pages) > self.size:
+        self.pages.popitem(last=False)
+
+  def discard(self, key):
+    with self.lock:
+      self.pages.pop(key, None)
+
+
+class _Reports(object):
+  """Renders the index and the project pages on the first request."""
+
+  PAGES = ('index.html', 'filter.html', 'authors.html', 'paths.html')
+
+  def __init__(self, options, first, second, pattern, trace=None):
+    self.options = options
+    self.first = first
+    self.second = second
+    self.pattern = pattern
+    self.results = dict()
+    self.store = ResultStore(options.output)
+    self.spill = GitDiffSubcmd.spill_store(options)
+    self.cache = _PageCache(options.cache_size)
+    # bound the reports rendered at the same time
+    self.workers = threading.BoundedSemaphore(max(1, options.job or 1))
+    self.lock = threading.Lock()
+    self.locks = dict()
+    # the index is rendered by one request at a time
+    self.index_lock = threading.Lock()
+    self.trace = trace or DiffTrace(enabled=False)
+
+  def close(self):
+    self.store.close()
+    if self.spill is not None:
+      self.spill.close()
+
+  def _project_lock(self, project):
+    with self.lock:
+      return self.locks.setdefault(project, threading.Lock())
+
+  def render_project(self, project):
+    options = self.options
+
+    with self._project_lock(project):
+      if project in self.results:
+        return
+
+      output = os.path.join(options.output, project)
+
+      with self.workers:
+        if options.prepare_graph or options.prepare_bitmap:
+          GitDiffSubcmd.prepare_graph(
+            self.trace.wrap(project, self.second[project]),
+            options.prepare_bitmap, project)
+
+        argp = list()
+        if project in self.first:
+          argp.append(self.first[project].revision)
+        argp.append(self.second[project].revision)
+
+        GitDiffSubcmd.generate_report(
+          ManifestIndex.resolve(self.second[project], argp),
+          self.second[project], project, options.output, output,
+          self.pattern, options.remote, options.gitiles,
+          options.gen_no_merge, self.results, quiet=True, trace=self.trace,
+          single_walk=options.single_walk,
+          walk_options=GitDiffSubcmd.walk_options(options),
+          secondary=options.secondary_index, search=options.search_index,
+          store=self.store, ref_jobs=options.ref_jobs,
+          compact=options.compact, spill=self.spill,
+          changes=GitDiffSubcmd.change_mode(options))
+
+      # the counts of the project are shown in the index since now
+      self.cache.discard(RepoDiffSubcmd.INDEX_HTML)
+
+  def render_index(self):
+    options = self.options
+    output = options.output
+
+    with self.index_lock:
+      with GitDiffSubcmd.open_page(
+          os.path.join(output, RepoDiffSubcmd.INDEX_HTML),
+          'Log Report for Manifest Difference', output, output,
+          quiet=True) as bd:
+        bd.p()
+        with bd.div(clazz='card w-75') as pdiv:
+          with pdiv.div(clazz='card-body') as cbd:
+            with cbd.table(clazz='table table-hover table-striped') as table:
+              for pname in sorted(set(self.first) | set(self.second)):
+                with table.tr() as tr:
+                  with tr.wtd() as td:
+                    td.span(pname)
+                    if pname not in self.second:
+                      td.span('removed', clazz='badge badge-danger')
+                      continue
+                    elif pname not in self.first:
+                      td.span('new', clazz='badge badge-warning')
+
+                    result = self.results.get(pname)
+                    if result is None:
+                      td.a(
+                        'render', href='%s/index.html' % pname,
+                        clazz='badge badge-light')
+                      continue
+
+                    for item, badge, page in (
+                        ('full', 'primary', 'index.html'),
+                        ('filter', 'secondary', 'filter.html')):
+                      val = getattr(result, item)
+                      if val:
+                        td.a(
+                          val, href='%s/%s' % (pname, page),
+                          clazz='badge badge-%s' % badge)
+
+  def page(self, path):
+    import mimetypes
+
+    try:
+      from urllib.parse import unquote
+    except ImportError:
+      from urllib import unquote
+
+    path = os.path.normpath(unquote(path).lstrip('/'))
+    if path in ('', '.'):
+      path = RepoDiffSubcmd.INDEX_HTML
+    elif path.startswith('..') or os.path.isabs(path):
+      return None
+
+    content = self.cache.get(path)
+    if content is None:
+      project, _, page = path.rpartition('/')
+      if path == RepoDiffSubcmd.INDEX_HTML:
+        self.render_index()
+      elif project in self.second and page in _Reports.PAGES:
+        self.render_project(project)
+
+      filename = os.path.join(self.options.output, path)
+      if not os.path.isfile(filename):
+        return None
+
+      with open(filename, 'rb') as fp:
+        content = fp.read()
+
+      if path.endswith('.html'):
+        self.cache.put(path, content)
+
+    ctype, _ = mimetypes.guess_type(path)
+    return ctype or 'application/octet-stream', content
+
+
+def _report_server(address, reports):
+  """Creates the HTTP server, whose modules are loaded only to serve."""
+  try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse
+  except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse
+
+  class _ReportHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=C0103
+      page = self.server.reports.page(urlparse(self.path).path)
+      if page is None:
+        self.send_error(404, 'No report found')
+        return
+
+      ctype, content = page
+      self.send_response(200)
+      self.send_header('Content-Type', ctype)
+      self.send_header('Content-Length', str(len(content)))
+      self.end_headers()
+      self.wfile.write(content)
+
+  class _ReportServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+  server = _ReportServer(address, _ReportHandler)
+  server.reports = reports
+
+  return server
+
+
+class RepoDiffServerSubcmd(RepoDiffSubcmd):
+  COMMAND = 'repo-diff-server'
+
+  help_summary = 'Serve the diff report of a repo project over HTTP'
+  help_usage = """\
+%prog [options] manifest.xml [diff-manifest.xml]
+
+Serves the repo-diff report on a local HTTP server.
+
+The index is available immediately, and the report of a project is generated
+on its first request with the same logic as repo-diff into the output
+directory. The recently served pages are kept in memory and the reports
+generated at the same time are bounded by the job count. The options of
+repo-diff to watch, profile, adapt the job count and generate the delta
+aren't supported."""
+
+  def options(self, optparse):
+    RepoDiffSubcmd.options(self, optparse)
+
+    options = optparse.add_option_group('Server options')
+    options.add_option(
+      '--bind',
+      dest='bind', action='store', default='127.0.0.1',
+      help='Set the address to listen, default: %default')
+    options.add_option(
+      '--port',
+      dest='port', action='store', type='int', default=8080,
+      help='Set the port to listen, 0 to pick a free one, default: %default')
+    options.add_option(
+      '--cache-size',
+      dest='cache_size', action='store', type='int', default=256,
+      help='Set the number of pages kept in memory, default: %default')
+
+  def execute(self, options, *args, **kws):
+    if options.gitiles:
+      RaiseExceptionIfOptionMissed(
+        options.remote, "remote need set for gitiles")
+
+    if options.prepare_graph or options.prepare_bitmap:
+      RaiseExceptionIfOptionMissed(
+        options.mirror, "mirror need set to prepare the commit-graph")
+
+    for value, option in (
+        (options.watch, 'watch'), (options.profile, 'profile'),
+        (options.adaptive_job, 'adaptive-job'),
+        (options.delta_from, 'delta-from')):
+      RaiseExceptionIfOptionMissed(
+        not value, "%s isn't supported by the server" % option)
+
+    RaiseExceptionIfOptionMissed(
+      len(args) < 3, "server works with one diff manifest only")
+
+    trace = DiffTrace(enabled=bool(options.trace))
+    pattern = RepoDiffSubcmd.get_patterns(options)  # pylint: disable=E1101
+    if not os.path.exists(options.output):
+      os.makedirs(options.output)
+
+    index = ManifestIndex(options, options.manifest_cache)
+    if len(args) > 1:
+      first = index.projects(args[0])
+      second = index.projects(args[1])
+    else:
+      first = dict()
+      second = index.projects(args[0] if args else None)
+
+    reports = _Reports(options, first, second, pattern, trace)
+    server = _report_server((options.bind, options.port), reports)
+
+    print('Serving reports on http://%s:%d/' % server.server_address[:2])
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      reports.close()
+
+    if options.trace:
+      trace.dump(options.trace, options.trace_format)
+
+    return True
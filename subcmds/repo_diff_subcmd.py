@@ -1,26 +1,593 @@
 
+import hashlib
+import json
 import os
+import re
+import sys
+import threading
 import time
 
 from synchronize import synchronized
-from git_diff_subcmd import GitDiffSubcmd
-from krep_subcmds.repo_subcmd import RepoSubcmd
-from krep_subcmds.repo_mirror_subcmd import RepoMirrorSubcmd
-from topics import FormattedFile, RaiseExceptionIfOptionMissed, \
-  SubCommandWithThread
+from git_diff_subcmd import Details, GitDiffSubcmd, Result, ResultStore, \
+  Snapshot, Statistics
+from topics import AtomicFile, DiffTrace, GitProject, \
+  RaiseExceptionIfOptionMissed, SubCommandWithThread
+
+
+class _ProjectProfiler(object):
+  """Profiles the report generation of a project into its output directory."""
+
+  PSTATS = 'profile.pstats'
+  SNAPSHOT = 'memory.snapshot'
+
+  lock = threading.Lock()
+  tracing = 0
+  # held by the project being profiled with cProfile, which is only active
+  # in one thread at a time since Python 3.12
+  profiling = threading.Lock()
+
+  def __init__(self, mode, threshold, output, name=None):
+    self.cpu = mode in ('cpu', 'all')
+    self.memory = mode in ('memory', 'all')
+    self.threshold = threshold or 0
+    self.output = output
+    self.name = name or output
+    self.profile = None
+    self.locked = False
+    self.start = None
+
+  def __enter__(self):
+    if self.memory:
+      try:
+        import tracemalloc
+
+        with _ProjectProfiler.lock:
+          if not _ProjectProfiler.tracing:
+            tracemalloc.start()
+          _ProjectProfiler.tracing += 1
+      except ImportError:
+        print('tracemalloc is unavailable, skip memory profiling')
+        self.memory = False
+
+    if self.cpu and sys.version_info >= (3, 12):
+      self.locked = _ProjectProfiler.profiling.acquire(False)
+      if not self.locked:
+        print('Skip profiling %s with cProfile while another project is '
+              'profiled' % self.name)
+
+    if self.cpu and (self.locked or sys.version_info < (3, 12)):
+      import cProfile
+
+      self.profile = cProfile.Profile()
+      try:
+        self.profile.enable()
+      except ValueError:
+        print('Skip profiling %s as another profiler is active' % self.name)
+        self.profile = None
+
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    elapsed = time.time() - self.start
+    keep = elapsed >= self.threshold and os.path.exists(self.output)
+
+    if self.profile:
+      self.profile.disable()
+      if keep:
+        self.profile.dump_stats(
+          os.path.join(self.output, _ProjectProfiler.PSTATS))
+
+    if self.locked:
+      _ProjectProfiler.profiling.release()
+      self.locked = False
+
+    if self.memory:
+      import tracemalloc
+
+      with _ProjectProfiler.lock:
+        if keep:
+          tracemalloc.take_snapshot().dump(
+            os.path.join(self.output, _ProjectProfiler.SNAPSHOT))
+
+        _ProjectProfiler.tracing -= 1
+        if not _ProjectProfiler.tracing:
+          tracemalloc.stop()
+
+
+class _AdaptiveLimiter(object):
+  """Limits the projects generated at the same time to hold the throughput."""
+
+  # the drop of throughput treated as the noise
+  TOLERANCE = 0.05
+
+  def __init__(self, maximum, trace, window=2.0):
+    self.maximum = max(1, maximum)
+    self.limit = max(1, (self.maximum + 1) // 2)
+    self.trace = trace
+    self.window = window
+    self.direction = 1
+    self.running = 0
+    self.throughput = None
+    self.cond = threading.Condition()
+    self._reset(time.time())
+
+  def _reset(self, now):
+    self.start = now
+    self.calls = 0
+    self.busy = 0.0
+
+  def __enter__(self):
+    with self.cond:
+      while self.running >= self.limit:
+        self.cond.wait()
+
+      self.running += 1
+
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    with self.cond:
+      self.running -= 1
+      self.cond.notify()
+
+  def __call__(self, name, category, item, start, end):
+    if category != 'git':
+      return
+
+    with self.cond:
+      self.calls += 1
+      self.busy += end - start
+      if end - self.start >= self.window:
+        self._adjust(end)
+
+  def _adjust(self, now):
+    throughput = self.calls / (now - self.start)
+    latency = self.busy / self.calls
+    if self.throughput is not None and \
+        throughput < self.throughput * (1 - _AdaptiveLimiter.TOLERANCE):
+      self.direction = -self.direction
+
+    limit = min(self.maximum, max(1, self.limit + self.direction))
+    if limit > self.limit:
+      self.cond.notify(limit - self.limit)
+
+    self.limit = limit
+    self.throughput = throughput
+    self._reset(now)
+
+    name = RepoDiffSubcmd.TRACE_NAME
+    self.trace.sample(name, 'limit', limit)
+    self.trace.sample(name, 'throughput', throughput)
+    self.trace.sample(name, 'latency', latency)
+
+
+class _NoLimiter(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    pass
+
+
+class ManifestIndex(object):
+  """Caches the parsed manifests and resolves the revisions of the projects."""
+
+  SHA1_MATCHER = re.compile(r'^[0-9a-f]{40}$')
+  # the project attributes kept in the cache to create the project again
+  FIELDS = (
+    'uri', 'worktree', 'gitdir', 'revision', 'remote', 'pushurl', 'bare')
+
+  def __init__(self, options, cache_dir=None):
+    self.options = options
+    self.cache_dir = cache_dir
+    self.manifests = dict()
+    self.lock = threading.Lock()
+    if cache_dir:
+      AtomicFile.cleanup(cache_dir)
+
+  def digest(self, manifest):
+    if not manifest or not os.path.isfile(manifest):
+      return None
+
+    import xml.etree.ElementTree as ElementTree
+
+    sha = hashlib.sha1()
+    sha.update(repr((
+      os.path.realpath(getattr(self.options, 'working_dir', None) or '.'),
+      bool(self.options.mirror), ManifestIndex.FIELDS)).encode('utf-8'))
+
+    # the included manifests are looked up beside the top one
+    top = os.path.dirname(os.path.abspath(manifest))
+    pending, seen = [manifest], set()
+    while pending:
+      filename = pending.pop(0)
+      if os.path.realpath(filename) in seen:
+        continue
+
+      seen.add(os.path.realpath(filename))
+      if not os.path.isfile(filename):
+        sha.update(repr((filename, None)).encode('utf-8'))
+        continue
+
+      with open(filename, 'rb') as fp:
+        content = fp.read()
+
+      sha.update(repr((filename, len(content))).encode('utf-8'))
+      sha.update(content)
+      try:
+        root = ElementTree.fromstring(content)
+      except ElementTree.ParseError:
+        # the manifest isn't cached without knowing all its files
+        return None
+
+      for include in root.iter('include'):
+        if include.get('name'):
+          pending.append(os.path.join(top, include.get('name')))
+
+    return sha.hexdigest()
+
+  def _fetch(self, manifest):
+    # the repo sub-commands are only loaded to read a manifest
+    if self.options.mirror:
+      from krep_subcmds.repo_mirror_subcmd import RepoMirrorSubcmd
+
+      manifestf = RepoMirrorSubcmd.fetch_projects_in_manifest
+    else:
+      from krep_subcmds.repo_subcmd import RepoSubcmd
+
+      manifestf = RepoSubcmd.fetch_projects_in_manifest
+
+    rets = dict()
+    if manifest:
+      projects = manifestf(self.options, manifest)
+    else:
+      projects = manifestf(self.options)
+
+    for project in projects:
+      rets[project.uri] = project
+
+    return rets
+
+  @staticmethod
+  def dump(projects, fp):
+    items = list()
+    for project in projects.values():
+      # only take the plain values as the project may treat the unknown
+      # attributes as git commands
+      items.append([
+        value if isinstance(value, (str, bool)) else None
+        for value in (
+          getattr(project, field, None) for field in ManifestIndex.FIELDS)])
+
+    json.dump(items, fp)
+
+  @staticmethod
+  def load(fp):
+    projects = dict()
+    for item in json.load(fp):
+      kws = dict(
+        (field, value)
+        for field, value in zip(ManifestIndex.FIELDS[1:], item[1:])
+        if value is not None)
+      projects[item[0]] = GitProject(item[0], **kws)
+
+    return projects
+
+  def projects(self, manifest=None):
+    digest = self.digest(manifest)
+    if digest is None:
+      return self._fetch(manifest)
+
+    # only the last digest of a manifest is kept as watch reads it again
+    # every cycle
+    with self.lock:
+      if self.manifests.get(manifest, (None,))[0] == digest:
+        return self.manifests[manifest][1]
+
+    cache = None
+    if self.cache_dir:
+      cache = os.path.join(self.cache_dir, '%s.json' % digest)
+      if os.path.exists(cache):
+        try:
+          with open(cache, 'r') as fp:
+            projects = ManifestIndex.load(fp)
+
+          with self.lock:
+            self.manifests[manifest] = (digest, projects)
+
+          return projects
+        except (IndexError, TypeError, ValueError):
+          pass
+
+    projects = self._fetch(manifest)
+    with self.lock:
+      self.manifests[manifest] = (digest, projects)
+
+    if cache:
+      if not os.path.exists(self.cache_dir):
+        try:
+          os.makedirs(self.cache_dir)
+        except OSError:
+          # created by another run sharing the cache
+          if not os.path.isdir(self.cache_dir):
+            raise
+
+      # the other runs sharing the cache write their own temporary files
+      try:
+        with AtomicFile(cache) as fp:
+          ManifestIndex.dump(projects, fp)
+      except (IOError, OSError):
+        pass
+
+    return projects
+
+  @staticmethod
+  def refs(project):
+    refs = dict()
+
+    # the peeled object of the annotated tag is preferred
+    args = ('for-each-ref', '--format=%(objectname):%(*objectname):%(refname)')
+    ret, spool = GitDiffSubcmd.spool_git(project, *args)
+    if spool is not None:
+      with spool:
+        lines = list(GitDiffSubcmd.iter_records(spool)) if ret == 0 else []
+    else:
+      ret, output = project.for_each_ref(*args[1:])
+      lines = output.split('\n') if ret == 0 else []
+
+    for line in lines:
+      items = line.strip('"').split(':', 2)
+      if len(items) == 3:
+        refs[items[2]] = items[1] or items[0]
+
+    return refs
+
+  @staticmethod
+  def resolve(project, revisions):
+    refs = None
+
+    rets = list()
+    for revision in revisions:
+      if not revision or ManifestIndex.SHA1_MATCHER.match(revision):
+        rets.append(revision)
+        continue
+
+      if refs is None:
+        refs = ManifestIndex.refs(project)
+
+      # follow the order of git-rev-parse and the remote fallback
+      for name in (
+          revision, 'refs/%s' % revision, 'refs/tags/%s' % revision,
+          'refs/heads/%s' % revision, 'refs/remotes/%s' % revision,
+          'refs/remotes/%s/HEAD' % revision,
+          'refs/remotes/%s/%s' % (project.remote, revision)):
+        if name in refs:
+          rets.append(refs[name])
+          break
+      else:
+        rets.append(revision)
+
+    return rets
+
+
+class RunJournal(object):
+  """Records the projects completed in the output directory."""
+
+  FILENAME = '.journal'
+
+  def __init__(self, output):
+    self.filename = os.path.join(output, RunJournal.FILENAME)
+    self.exists = os.path.exists(self.filename)
+    self.done = set()
+    # whether the last run completed all its projects
+    self.finished = False
+    self.lock = threading.Lock()
+
+    lines = 0
+    if self.exists:
+      with open(self.filename, 'r') as fp:
+        for line in fp:
+          lines += 1
+          # the last line might be partially written
+          if line.endswith('\n') and line.startswith('done '):
+            self.done.add(line[5:-1])
+            self.finished = False
+          elif line == 'end\n':
+            self.finished = True
+
+      if lines > len(self.done) + int(self.finished):
+        with AtomicFile(self.filename) as fp:
+          for project in sorted(self.done):
+            fp.write('done %s\n' % project)
+          if self.finished:
+            fp.write('end\n')
+
+    self.fp = open(self.filename, 'a')
+
+  def trusted(self, project):
+    return not self.exists or project in self.done
+
+  def finish(self, project):
+    with self.lock:
+      if project in self.done:
+        return
+
+      self.done.add(project)
+      self.fp.write('done %s\n' % project)
+      self.fp.flush()
+      os.fsync(self.fp.fileno())
+
+  def close(self, projects=()):
+    # the run completing all the projects isn't resumed
+    if projects and all(project in self.done for project in projects):
+      self.fp.write('end\n')
+
+    self.fp.close()
+
+
+class _SharedRanges(object):
+  """Shares the collected ranges between the projects walking the same."""
+
+  def __init__(self, keys):
+    # only the ranges of more than one project are shared
+    counts = dict()
+    for key in keys.values():
+      if key:
+        counts[key] = counts.get(key, 0) + 1
+
+    self.keys = dict(
+      (project, key) for project, key in keys.items()
+      if key and counts[key] > 1)
+    self.users = dict((key, count) for key, count in counts.items()
+                      if count > 1)
+    self.events = dict((key, threading.Event()) for key in self.users)
+    self.owners = dict()
+    self.collected = dict()
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def key(project, revisions, options):
+    # only the resolved revisions name the same commits in the projects
+    if not revisions or not all(
+        revision and ManifestIndex.SHA1_MATCHER.match(revision)
+        for revision in revisions):
+      return None
+
+    store = GitDiffSubcmd.object_store(project)
+    if store is None:
+      return None
+
+    sha = hashlib.sha1()
+    sha.update(repr((
+      store, tuple(revisions), bool(options.single_walk),
+      tuple(GitDiffSubcmd.walk_options(options)))).encode('utf-8'))
+
+    return sha.hexdigest()
+
+  def claim(self, project):
+    """Returns the project collecting the ranges if it's another one."""
+    key = self.keys.get(project)
+    if key is None:
+      return None
+
+    with self.lock:
+      owner = self.owners.setdefault(key, project)
+
+    return None if owner == project else owner
+
+  def publish(self, project, collected):
+    key = self.keys.get(project)
+    if key is None:
+      return False
+
+    with self.lock:
+      self.collected[key] = collected
+    self.events[key].set()
+
+    return True
+
+  def wait(self, project):
+    key = self.keys[project]
+    self.events[key].wait()
+
+    with self.lock:
+      return self.collected.get(key)
+
+  def done(self, project):
+    key = self.keys.get(project)
+    if key is None:
+      return
+
+    # the owner failing to collect lets the others collect by themselves
+    self.events[key].set()
+    with self.lock:
+      self.users[key] -= 1
+      if self.users[key]:
+        return
+
+      collected = self.collected.pop(key, None)
+
+    # the last project rendered gives the budget of the ranges back
+    if collected is not None:
+      collected[-1]()
+
+
+class _SharedDetails(object):
+  """Closes the details of a project once the projects sharing them end."""
+
+  def __init__(self, details):
+    self.details = details
+    self.users = 1
+    self.lock = threading.Lock()
+
+  def hold(self, collected):
+    """Returns the collected ranges closing the details when released."""
+    release = collected[-1]
+
+    def _release():
+      release()
+      self.close()
+
+    with self.lock:
+      self.users += 1
+
+    return collected[:-1] + (_release,)
+
+  def close(self):
+    with self.lock:
+      self.users -= 1
+      if self.users:
+        return
+
+    self.details.close()
+
+
+class _TargetState(object):
+  """Keeps the resolved revisions and results of a target between runs."""
+
+  def __init__(self):
+    self.revisions = dict()
+    self.results = dict()
+    self.stats = dict()
+
+
+class _TargetRun(object):
+  """Keeps the stores of a target generated along with the others."""
+
+  def __init__(self, output, second, state=None):
+    self.output = output
+    self.second = second
+    self.state = state
+    self.revisions = dict()
+    self.keys = dict()
+    self.projects = list()
+    self.updated = True
+    self.store = None
+    self.snapshot = None
+    self.journal = None
+    self.shared = None
 
 
 class RepoDiffSubcmd(GitDiffSubcmd, SubCommandWithThread):
   COMMAND = 'repo-diff'
 
   INDEX_HTML = 'index.html'
+  STATS_JSON = 'stats.json'
+  # the name to trace the phases not belonging to any project
+  TRACE_NAME = '(manifest)'
 
   help_summary = 'Generate the diff report for a repo project'
   help_usage = """\
 %prog [options] manifest.xml [diff-manifest.xml] ...
 
 Handle the git-repo project git commits diff and generate the reports in
-purposed formats."""
+purposed formats.
+
+If more than one diff manifests provided, the first manifest would be the
+baseline of the others. A report tree is generated for each of them named
+after the manifest file, and the commit details are shared between them. The
+top-level index shows a matrix of the projects against the manifests."""
 
   def options(self, optparse):
     GitDiffSubcmd.options(self, optparse, inherited=True)
@@ -30,66 +597,427 @@ purposed formats."""
       '--mirror',
       dest='mirror', action='store_true',
       help='Set to work with a git-repo mirror project')
+    options.add_option(
+      '--prepare-graph',
+      dest='prepare_graph', action='store_true',
+      help='Write the commit-graph of the mirror projects before walking')
+    options.add_option(
+      '--prepare-bitmap',
+      dest='prepare_bitmap', action='store_true',
+      help='Repack the mirror projects with reachability bitmaps either, '
+           'except the ones borrowing the objects from an alternate')
+    options.add_option(
+      '--manifest-cache',
+      dest='manifest_cache', action='store',
+      help='Set the directory to cache the parsed manifests')
+    options.add_option(
+      '--adaptive-job',
+      dest='adaptive_job', action='store_true',
+      help='Adjust the projects generated at the same time up to the job '
+           'count by the throughput of the git calls')
+
+    options = optparse.add_option_group('Watch options')
+    options.add_option(
+      '--watch',
+      dest='watch', action='store_true',
+      help='Keep running to regenerate the reports of the updated projects')
+    options.add_option(
+      '--interval',
+      dest='interval', action='store', type='int', default=300,
+      help='Set the seconds to poll the manifest and the project refs, '
+           'default: %default')
+
+    options = optparse.get_option_group('--trace') or \
+      optparse.add_option_group('Debug options')
+    options.add_option(
+      '--profile',
+      dest='profile', action='store',
+      type='choice', choices=('cpu', 'memory', 'all'),
+      help='Profile each project with cProfile (cpu), tracemalloc (memory) '
+           'or both (all) into its output directory, cProfile profiles one '
+           'project at a time since Python 3.12 and skips the ones started '
+           'meanwhile')
+    options.add_option(
+      '--profile-threshold',
+      dest='profile_threshold', action='store', type='float', default=0,
+      help='Keep the profiles of the projects slower than the seconds, '
+           'default: %default')
 
   def execute(self, options, *args, **kws):
     if options.gitiles:
       RaiseExceptionIfOptionMissed(
         options.remote, "remote need set for gitiles")
 
+    if options.prepare_graph or options.prepare_bitmap:
+      RaiseExceptionIfOptionMissed(
+        options.mirror, "mirror need set to prepare the commit-graph")
+
+    if options.watch:
+      RaiseExceptionIfOptionMissed(
+        len(args) < 3, "watch works with one diff manifest only")
+
+    trace = DiffTrace(enabled=bool(options.trace))
     pattern = RepoDiffSubcmd.get_patterns(options)  # pylint: disable=E1101
     if not os.path.exists(options.output):
       os.makedirs(options.output)
 
-    def make_projects(projects):
-      rets = dict()
+    index = ManifestIndex(options, options.manifest_cache)
+    if options.watch:
+      return self.watch(options, args, index, pattern, trace)
 
-      for project in projects:
-        rets[project.uri] = project
+    with trace.phase(RepoDiffSubcmd.TRACE_NAME, 'manifest'):
+      targets = list()
+      if len(args) > 1:
+        first = index.projects(args[0])
+        for name, manifest in zip(
+            RepoDiffSubcmd.target_names(args[1:]), args[1:]):
+          targets.append((name, index.projects(manifest)))
+      else:
+        first = dict()
+        targets.append(('', index.projects(args[0] if args else None)))
 
-      return rets
+    spill = GitDiffSubcmd.spill_store(options)
+    try:
+      if len(targets) == 1:
+        self.generate_targets(
+          options, first, [(options.output, targets[0][1])], pattern, trace,
+          spill=spill)
+      else:
+        # the targets are generated project by project to walk the ranges
+        # of a project once
+        results = self.generate_targets(
+          options, first,
+          [(os.path.join(options.output, name), second)
+           for name, second in targets], pattern, trace, spill=spill)
 
-    if options.mirror:
-      manifestf = RepoMirrorSubcmd.fetch_projects_in_manifest
-    else:
-      manifestf = RepoSubcmd.fetch_projects_in_manifest
+        with trace.phase(RepoDiffSubcmd.TRACE_NAME, 'matrix'):
+          RepoDiffSubcmd.generate_matrix(
+            options, options.output, first,
+            [(name, second, result)
+             for (name, second), result in zip(targets, results)])
+    finally:
+      if spill is not None:
+        spill.close()
 
-    if len(args) > 1:
-      first = make_projects(manifestf(options, args[0]))
-      second = make_projects(manifestf(options, args[1]))
-    else:
-      first = dict()
-      if len(args) > 0:
-        second = make_projects(manifestf(options, args[0]))
-      else:
-        second = make_projects(manifestf(options))
+    if options.trace:
+      trace.dump(options.trace, options.trace_format)
+
+    return True
+
+  def watch(self, options, args, index, pattern, trace):
+    state = _TargetState()
+    # keep the details and the project handles warm between the runs
+    details = dict()
+    spill = GitDiffSubcmd.spill_store(options)
+
+    try:
+      while True:
+        start = time.time()
+        with trace.phase(RepoDiffSubcmd.TRACE_NAME, 'manifest'):
+          if len(args) > 1:
+            first = index.projects(args[0])
+            second = index.projects(args[1])
+          else:
+            first = dict()
+            second = index.projects(args[0] if args else None)
+
+        # the details of the removed projects give their budget back
+        for project in [proj for proj in details if proj not in second]:
+          details.pop(project).close()
+
+        self.generate_targets(
+          options, first, [(options.output, second)], pattern, trace,
+          details, state, spill)
+        if options.trace:
+          trace.dump(options.trace, options.trace_format)
+
+        time.sleep(max(0, options.interval - (time.time() - start)))
+    except KeyboardInterrupt:
+      pass
+    finally:
+      for detail in details.values():
+        detail.close()
+      if spill is not None:
+        spill.close()
+
+    return True
+
+  @staticmethod
+  def target_names(manifests):
+    # the targets can't take the names of the matrix files in the output
+    taken = set(('asserts', RepoDiffSubcmd.INDEX_HTML))
+    bases = [os.path.splitext(os.path.basename(manifest))[0] or 'target'
+             for manifest in manifests]
 
-    results = dict()
+    # the plain names are kept ahead not to be taken by the suffixed ones
+    names = list()
+    for base in bases:
+      names.append(None if base in taken else base)
+      taken.add(base)
 
-    def generate_report(
-        project, remote, options, origins, references, pattern, results):
-      print("Generating for %s ..." % origins[project])
+    for index, base in enumerate(bases):
+      if names[index] is None:
+        suffix = 2
+        while '%s-%d' % (base, suffix) in taken:
+          suffix += 1
 
+        names[index] = '%s-%d' % (base, suffix)
+        taken.add(names[index])
+
+    return names
+
+  def prepare_target(self, options, run, first, trace):
+    if not os.path.exists(run.output):
+      os.makedirs(run.output)
+    # the temporary files of the interrupted runs are never published
+    AtomicFile.cleanup(run.output)
+
+    second, revisions, keys = run.second, run.revisions, run.keys
+
+    def resolve_revisions(project, origins, references):
       argp = list()
       if project in references:
         argp.append(references[project].revision)
 
       argp.append(origins[project].revision)
+      revisions[project] = ManifestIndex.resolve(
+        trace.wrap(project, origins[project]), argp)
+      keys[project] = _SharedRanges.key(
+        trace.wrap(project, origins[project]), revisions[project], options)
+
+    with trace.phase(RepoDiffSubcmd.TRACE_NAME, 'resolve'):
+      self.run_with_thread(
+        options.job, second, resolve_revisions, second, first)
+
+    store = ResultStore(run.output)
+    state = run.state
+    if state is None:
+      run.state = _TargetState()
+      run.projects = list(second)
+    else:
+      # only the projects with updated revisions are generated again
+      run.projects = [
+        project for project in second
+        if state.revisions.get(project) != revisions[project]]
+      for project in list(state.results) + run.projects:
+        if project in run.projects or project not in second:
+          state.results.pop(project, None)
+          state.stats.pop(project, None)
+          store.discard(project)
+
+      updated = run.projects or set(state.revisions) != set(revisions)
+      state.revisions = revisions
+      if not updated:
+        run.updated = False
+        store.close()
+        return
+
+    # the projects not generated again keep their SHA-1s in the snapshot
+    run.snapshot = Snapshot.load(os.path.join(run.output, Snapshot.FILENAME))
+    run.journal = RunJournal(run.output)
+    if run.journal.done and not run.journal.finished:
+      print('Resume with %d completed projects' % len(run.journal.done))
+
+    # the result left by an interrupted run isn't trusted
+    for project in run.projects:
+      if not run.journal.trusted(project):
+        store.discard(project)
+
+    # the cached projects don't collect their ranges
+    run.store = store
+    run.shared = _SharedRanges(dict(
+      (project, keys[project]) for project in run.projects
+      if project not in store))
+
+  @staticmethod
+  def walk_targets(project, runs, name):
+    """Walks the ranges of the targets from the same base at once."""
+    revisions = [
+      run.revisions[name] for run in runs
+      if name in run.projects and name not in run.store]
+    if len(revisions) < 2 or not all(
+        len(revision) == 2 and all(
+          ManifestIndex.SHA1_MATCHER.match(sha1) for sha1 in revision)
+        for revision in revisions):
+      return None, None
+
+    base = revisions[0][0]
+    walked = GitDiffSubcmd.walk_union(
+      project, base, set(
+        revision[1] for revision in revisions if revision[0] == base))
+
+    return base, walked
+
+  def generate_targets(
+      self, options, first, targets, pattern, trace, details=None,
+      state=None, spill=None):
+    """Generates the targets, a project is walked once for all of them."""
+    runs = list()
+    try:
+      for output, second in targets:
+        runs.append(_TargetRun(output, second, state))
+        self.prepare_target(options, runs[-1], first, trace)
+
+      self._generate_projects(options, runs, pattern, trace, details, spill)
+    finally:
+      for run in runs:
+        if run.store is not None:
+          run.journal.close(run.second)
+          run.store.close()
+
+    for run in runs:
+      if run.updated:
+        RepoDiffSubcmd.finish_target(options, run, first, trace)
+
+    return [run.state.results for run in runs]
+
+  def _generate_projects(self, options, runs, pattern, trace, details, spill):
+    limiter = None
+    if options.adaptive_job:
+      limiter = _AdaptiveLimiter(options.job or 1, trace)
+      trace.listen(limiter)
+
+    # the project of more targets is listed once
+    projects = list()
+    for run in runs:
+      for project in run.projects:
+        if project not in projects:
+          projects.append(project)
+
+    def generate_report(project, remote, options, pattern):
+      # the details are given back once the last target of the project
+      # and the projects sharing its ranges end
+      holder = None
+      if details is None:
+        holder = _SharedDetails(Details(spill))
+        pdetails = holder.details
+      else:
+        pdetails = details.setdefault(project, Details(spill))
+
+      pending = [run for run in runs if project in run.projects]
+      base, walked = None, None
+      try:
+        while pending:
+          run = pending.pop(0)
+          origins = run.second
+          print("Generating for %s ..." % origins[project])
+
+          argp = run.revisions[project]
+          poutput = os.path.join(run.output, project)
+          gitp = trace.wrap(project, origins[project])
+
+          start = time.time()
+          owner = run.shared.claim(project)
+          collected = None
+          if owner:
+            # waited out of the limiter not to hold the slots from the owner
+            collected = run.shared.wait(project)
+            if collected is not None:
+              print('Share the ranges of %s with %s' % (
+                origins[project], owner))
+
+          collecting = collected is None and project not in run.store
+          if collecting and walked is None and (
+              options.prepare_graph or options.prepare_bitmap):
+            GitDiffSubcmd.prepare_graph(gitp, options.prepare_bitmap, project)
+
+          def publish(collected, run=run):
+            if holder is not None:
+              collected = holder.hold(collected)
+            if run.shared.publish(project, collected):
+              return True
 
-      start = time.time()
-      GitDiffSubcmd.generate_report(
-        argp, origins[project],
-        project, options.output,
-        os.path.join(options.output, project),
-        pattern, remote, options.gitiles, options.gen_no_merge, results,
-        quiet=True)
+            # the ranges not handed are released by the project itself
+            if holder is not None:
+              holder.close()
+            return False
 
-      print('Handle %s with %s' % (
-        origins[project], GitDiffSubcmd.time_diff(time.time(), start)))
+          try:
+            with limiter or _NoLimiter(), _ProjectProfiler(
+                options.profile, options.profile_threshold, poutput,
+                project):
+              if collecting and walked is None:
+                base, walked = RepoDiffSubcmd.walk_targets(
+                  gitp, [run] + pending, project)
+                walked = walked or dict()
 
-    self.run_with_thread(
-      options.job, second, generate_report, options.remote, options,
-      second, first, pattern, results)
+              GitDiffSubcmd.generate_report(
+                argp, origins[project],
+                project, run.output, poutput,
+                pattern, remote, options.gitiles, options.gen_no_merge,
+                run.state.results, quiet=True, trace=trace,
+                single_walk=options.single_walk,
+                walk_options=GitDiffSubcmd.walk_options(options),
+                details=pdetails,
+                stats=run.state.stats.setdefault(project, Statistics()),
+                secondary=options.secondary_index,
+                search=options.search_index, store=run.store,
+                ref_jobs=options.ref_jobs, snapshot=run.snapshot,
+                compact=options.compact, spill=spill,
+                changes=GitDiffSubcmd.change_mode(options),
+                collected=collected,
+                publish=None if owner else publish,
+                walked=walked.get(argp[-1])
+                if len(argp) == 2 and argp[0] == base else None)
+          finally:
+            run.shared.done(project)
 
+          if collected is not None:
+            run.store.put_shared(project, owner)
+          run.journal.finish(project)
+          print('Handle %s with %s' % (
+            origins[project], GitDiffSubcmd.time_diff(time.time(), start)))
+      finally:
+        # the targets left by the failure let the others collect the ranges
+        for run in pending:
+          run.shared.done(project)
+        if holder is not None:
+          holder.close()
+
+    try:
+      self.run_with_thread(
+        options.job, projects, generate_report, options.remote, options,
+        pattern)
+    finally:
+      if limiter is not None:
+        trace.unlisten(limiter)
+
+  @staticmethod
+  def finish_target(options, run, first, trace):
+    output, second = run.output, run.second
+    snapshot, stats = run.snapshot, run.state.stats
+
+    snapshot.retain(second)
+    snapshot.dump(os.path.join(output, Snapshot.FILENAME))
+    if options.delta_from:
+      with trace.phase(RepoDiffSubcmd.TRACE_NAME, 'delta'):
+        GitDiffSubcmd.generate_delta(
+          output, Snapshot.load(options.delta_from), snapshot, second,
+          options.remote, options.gitiles)
+
+    total = Statistics()
+    for stat in stats.values():
+      total.merge(stat)
+
+    with AtomicFile(os.path.join(output, RepoDiffSubcmd.STATS_JSON)) as fp:
+      json.dump({
+        'total': total.value(),
+        'projects': dict((name, stat.value())
+                         for name, stat in stats.items() if stat.commits)},
+        fp, indent=2, sort_keys=True)
+
+    # the badges of the shared projects are kept for the cached ones
+    results = run.state.results
+    shared = dict(
+      (project, run.store.get_shared(project)) for project in results
+      if run.store.get_shared(project))
+    with trace.phase(RepoDiffSubcmd.TRACE_NAME, 'index'):
+      RepoDiffSubcmd.generate_index(
+        options, output, first, second, results, total, shared)
+
+  @staticmethod
+  def generate_index(
+      options, output, first, second, results, stats=None, shared=None):
     new_projects = list()
     modified_projects = list()
     removed_projects = list()
@@ -108,149 +1036,207 @@ purposed formats."""
       if project not in second:
         removed_projects.append(project)
 
-    with FormattedFile.open(
-        os.path.join(options.output, 'index.html')) as outfile:
-      with outfile.head() as head:
-        head.meta(charset='utf-8')
-        head.title('Log Report for Manifest Difference')
-
-        head.comment(' Boot strap core CSS ')
-        head.link(
-          href=GitDiffSubcmd.deploy(
-            'asserts/css/bootstrap.min.css', options.output, options.output),
-          rel='stylesheet')
-        head.link(
-          href=GitDiffSubcmd.deploy(
-            'asserts/css/krep-diff.css', options.output, options.output),
-          rel='stylesheet')
-
-      with outfile.body() as bd:
-        with bd.nav(clazz="nav navbar-dark bg-dark") as nav:
-          with nav.wbutton(clazz="navbar-toggler", type="button") as bnav:
-            bnav.span('', clazz="navbar-toggler-icon")
-
-        bd.p()
-        with bd.div(id='accordion') as acc:
-          index = 0
-          for pinfo, title in (
-              (new_projects, 'New Projects'),
-              (modified_projects, 'Modified Projects')):
-            if not pinfo:
-              continue
-
-            index += 1
-            with acc.div(clazz='card w-75', id='entire_%d' % index) as pdiv:
-              name = 'project_%d' % index
-              hid = 'head_%d' % index
-              with pdiv.div(clazz='card-header', id=hid) as dhd:
-                with dhd.wh5(clazz='mb-0') as h5:
-                  with h5.wbutton(
-                      title,
-                      clazz='btn btn-link', data_toggle='collapse',
-                      data_target='#%s' % name, aria_expanded='true',
-                      aria_controls=name) as wb:
-                    wb.span(len(pinfo), clazz='badge badge-info')
-
-              with pdiv.div(
-                  clazz='collapse show', id=name, aria_labelledby=hid,
-                  data_parent='#%s' % name) as cont:
-                with cont.div(clazz='card-body') as cbd:
-                  with cbd.table(clazz='table table-hover table-striped') \
-                      as table:
-                    for pname in sorted(pinfo):
-                      project = second[pname]
-                      with table.tr() as tr:
-                        with tr.wtd() as td:
-                          result = results.get(pname)
-                          if options.gitiles and result and result.remote:
-                            td.a(
-                              pname, href='%s/plugins/gitiles/%s' % (
-                                result.remote, pname))
-                          else:
-                            td.span(pname)
-
-                          for item, badge, page in (
-                              ('full', 'primary', 'index.html'),
-                              ('filter', 'secondary', 'filter.html')):
-                            val = getattr(result, item)
-                            if val:
-                              td.a(
-                                val, href='%s/%s' % (pname, page),
-                                clazz='badge badge-%s' % badge)
-
-          if noupdate_projects:
-            index += 1
-            with acc.div(clazz='card w-75', id='entire_%d' % index) as pdiv:
-              name = 'noupdt_project'
-              hid = 'head_%d' % index
-              with pdiv.div(clazz='card-header', id=hid) as dhd:
-                with dhd.wh5(clazz='mb-0') as h5:
-                  with h5.wbutton(
-                      'Non-updated Projects',
-                      clazz='btn btn-link', data_toggle='collapse',
-                      data_target='#%s' % name, aria_expanded='true',
-                      aria_controls=name) as wb:
-                    wb.span(len(noupdate_projects), clazz='badge badge-info')
-
-              with pdiv.div(
-                  clazz='collapse show', id=name, aria_labelledby=hid,
-                  data_parent='#%s' % name) as cont:
-                with cont.div(clazz='card-body') as cbd:
-                  with cbd.table(clazz='table table-hover table-striped') \
-                      as table:
-                    for pname in sorted(noupdate_projects):
-                      with table.tr() as tr:
-                        with tr.wtd() as td:
-                          result = results.get(pname)
-                          if options.gitiles and result and result.remote:
-                            td.a(
-                              pname, href='%s/plugins/gitiles/%s' % (
-                                result.remote, pname))
-                          else:
-                            td.span(pname)
-
-          if removed_projects:
-            index += 1
-            with acc.div(clazz='card w-75', id='entire_%d' % index) as remp:
-              name = 'rm_project'
-              hid = 'head_%d' % index
-              with remp.div(clazz='card-header', id=hid) as dhd:
-                with dhd.wh5(clazz='mb-0') as h5:
-                  with h5.wbutton(
-                      'Removed Projects',
-                      clazz='btn btn-link', data_toggle='collapse',
-                      data_target='#%s' % name, aria_expanded='true',
-                      aria_controls=name) as wb:
-                    wb.span(len(removed_projects), clazz='badge badge-info')
-
-              with remp.div(
-                  clazz='collapse show', id=name, aria_labelledby=hid,
-                  data_parent='#%s' % name) as cont:
-                with cont.div(clazz='card-body') as cbd:
-                  with cbd.table(clazz='table table-hover table-striped') \
-                      as table:
-                    for pname in sorted(removed_projects):
-                      with table.tr() as tr:
-                        with tr.wtd() as td:
-                          result = results.get(pname)
-                          if options.gitiles and result and result.remote:
+    with GitDiffSubcmd.open_page(
+        os.path.join(output, RepoDiffSubcmd.INDEX_HTML),
+        'Log Report for Manifest Difference', output, output) as bd:
+      bd.p()
+      with bd.div(id='accordion') as acc:
+        index = 0
+        for pinfo, title in (
+            (new_projects, 'New Projects'),
+            (modified_projects, 'Modified Projects')):
+          if not pinfo:
+            continue
+
+          index += 1
+          with acc.div(clazz='card w-75', id='entire_%d' % index) as pdiv:
+            name = 'project_%d' % index
+            hid = 'head_%d' % index
+            with pdiv.div(clazz='card-header', id=hid) as dhd:
+              with dhd.wh5(clazz='mb-0') as h5:
+                with h5.wbutton(
+                    title,
+                    clazz='btn btn-link', data_toggle='collapse',
+                    data_target='#%s' % name, aria_expanded='true',
+                    aria_controls=name) as wb:
+                  wb.span(len(pinfo), clazz='badge badge-info')
+
+            with pdiv.div(
+                clazz='collapse show', id=name, aria_labelledby=hid,
+                data_parent='#%s' % name) as cont:
+              with cont.div(clazz='card-body') as cbd:
+                with cbd.table(clazz='table table-hover table-striped') \
+                    as table:
+                  for pname in sorted(pinfo):
+                    project = second[pname]
+                    with table.tr() as tr:
+                      with tr.wtd() as td:
+                        result = results.get(pname)
+                        if options.gitiles and result and result.remote:
+                          td.a(
+                            pname, href='%s/plugins/gitiles/%s' % (
+                              result.remote, pname))
+                        else:
+                          td.span(pname)
+
+                        for item, badge, page in (
+                            ('full', 'primary', 'index.html'),
+                            ('filter', 'secondary', 'filter.html')):
+                          val = getattr(result, item)
+                          if val:
                             td.a(
-                              pname, href='%s/plugins/gitiles/%s' % (
-                                result.remote, pname))
-                          else:
-                            td.span(pname)
-
-        bd.script(
-          "window.jQuery || document.write('<script src=\"%s\">"
-          "<\/script>')" % GitDiffSubcmd.deploy(
-            'asserts/js/vendor/jquery-slim.min.js',
-            options.output, options.output),
-          _escape=False)
-        # write an empty string to keep <script></script> to make js working
-        bd.script(
-          '',
-          src=GitDiffSubcmd.deploy(
-            'asserts/js/bootstrap.min.js', options.output, options.output))
+                              val, href='%s/%s' % (pname, page),
+                              clazz='badge badge-%s' % badge)
 
-    return True
+                        if shared and pname in shared:
+                          td.span(
+                            'shared with %s' % shared[pname],
+                            clazz='badge badge-light')
+
+        if noupdate_projects:
+          index += 1
+          with acc.div(clazz='card w-75', id='entire_%d' % index) as pdiv:
+            name = 'noupdt_project'
+            hid = 'head_%d' % index
+            with pdiv.div(clazz='card-header', id=hid) as dhd:
+              with dhd.wh5(clazz='mb-0') as h5:
+                with h5.wbutton(
+                    'Non-updated Projects',
+                    clazz='btn btn-link', data_toggle='collapse',
+                    data_target='#%s' % name, aria_expanded='true',
+                    aria_controls=name) as wb:
+                  wb.span(len(noupdate_projects), clazz='badge badge-info')
+
+            with pdiv.div(
+                clazz='collapse show', id=name, aria_labelledby=hid,
+                data_parent='#%s' % name) as cont:
+              with cont.div(clazz='card-body') as cbd:
+                with cbd.table(clazz='table table-hover table-striped') \
+                    as table:
+                  for pname in sorted(noupdate_projects):
+                    with table.tr() as tr:
+                      with tr.wtd() as td:
+                        result = results.get(pname)
+                        if options.gitiles and result and result.remote:
+                          td.a(
+                            pname, href='%s/plugins/gitiles/%s' % (
+                              result.remote, pname))
+                        else:
+                          td.span(pname)
+
+        if removed_projects:
+          index += 1
+          with acc.div(clazz='card w-75', id='entire_%d' % index) as remp:
+            name = 'rm_project'
+            hid = 'head_%d' % index
+            with remp.div(clazz='card-header', id=hid) as dhd:
+              with dhd.wh5(clazz='mb-0') as h5:
+                with h5.wbutton(
+                    'Removed Projects',
+                    clazz='btn btn-link', data_toggle='collapse',
+                    data_target='#%s' % name, aria_expanded='true',
+                    aria_controls=name) as wb:
+                  wb.span(len(removed_projects), clazz='badge badge-info')
+
+            with remp.div(
+                clazz='collapse show', id=name, aria_labelledby=hid,
+                data_parent='#%s' % name) as cont:
+              with cont.div(clazz='card-body') as cbd:
+                with cbd.table(clazz='table table-hover table-striped') \
+                    as table:
+                  for pname in sorted(removed_projects):
+                    with table.tr() as tr:
+                      with tr.wtd() as td:
+                        result = results.get(pname)
+                        if options.gitiles and result and result.remote:
+                          td.a(
+                            pname, href='%s/plugins/gitiles/%s' % (
+                              result.remote, pname))
+                        else:
+                          td.span(pname)
+
+        if stats and stats.commits:
+          index += 1
+          RepoDiffSubcmd.update_stats(acc, stats, index)
+
+  @staticmethod
+  def update_stats(accord, stats, index):
+    with accord.div(clazz='card w-75', id='entire_%d' % index) as sdiv:
+      name = 'stats'
+      hid = 'head_%d' % index
+      with sdiv.div(clazz='card-header', id=hid) as dhd:
+        with dhd.wh5(clazz='mb-0') as h5:
+          with h5.wbutton(
+              'Statistics',
+              clazz='btn btn-link', data_toggle='collapse',
+              data_target='#%s' % name, aria_expanded='true',
+              aria_controls=name) as wb:
+            wb.span(stats.commits, clazz='badge badge-info')
+
+      with sdiv.div(
+          clazz='collapse show', id=name, aria_labelledby=hid,
+          data_parent='#%s' % name) as cont:
+        with cont.div(clazz='card-body') as cbd:
+          for title, items in (
+              ('Author', stats.authors.most_common()),
+              ('Committer Domain', stats.domains.most_common()),
+              ('Month', sorted(stats.months.items()))):
+            with cbd.table(clazz='table table-hover table-striped') as table:
+              with table.tr() as tr:
+                tr.th(title, scope='col')
+                tr.th('Commits', scope='col')
+
+              for key, count in items:
+                with table.tr() as tr:
+                  tr.td(key)
+                  tr.td(count)
+
+  @staticmethod
+  def generate_matrix(options, output, first, matrix):
+    projects = set(first)
+    for _, second, _ in matrix:
+      projects.update(second)
+
+    with GitDiffSubcmd.open_page(
+        os.path.join(output, RepoDiffSubcmd.INDEX_HTML),
+        'Log Report for Manifest Differences', output, output) as bd:
+      bd.p()
+      with bd.div(clazz='card w-95') as pdiv:
+        with pdiv.div(clazz='card-body') as cbd:
+          with cbd.table(clazz='table table-hover table-striped') as table:
+            with table.tr() as tr:
+              tr.th('Project', scope='col')
+              for name, _, _ in matrix:
+                with tr.wth(scope='col') as th:
+                  th.a(name, href='%s/%s' % (name, RepoDiffSubcmd.INDEX_HTML))
+
+            for pname in sorted(projects):
+              with table.tr() as tr:
+                with tr.wtd() as td:
+                  result = None
+                  for _, _, results in matrix:
+                    result = result or results.get(pname)
+
+                  if options.gitiles and result and result.remote:
+                    td.a(
+                      pname, href='%s/plugins/gitiles/%s' % (
+                        result.remote, pname))
+                  else:
+                    td.span(pname)
+
+                for name, second, results in matrix:
+                  with tr.wtd() as td:
+                    result = results.get(pname)
+                    if pname not in second:
+                      td.span('removed', clazz='badge badge-danger')
+                    elif pname not in first:
+                      td.span('new', clazz='badge badge-warning')
 
+                    for item, badge, page in (
+                        ('full', 'primary', 'index.html'),
+                        ('filter', 'secondary', 'filter.html')):
+                      val = getattr(result, item, 0)
+                      if val:
+                        td.a(
+                          val, href='%s/%s/%s' % (name, pname, page),
+                          clazz='badge badge-%s' % badge)
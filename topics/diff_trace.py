@@ -0,0 +1,177 @@
+
+import json
+import threading
+import time
+
+
+class _TracedProject(object):
+  """Proxies a git project to count and time each git sub-command."""
+
+  def __init__(self, trace, name, project):
+    self._trace = trace
+    self._name = name
+    self._project = project
+
+  def __getattr__(self, attr):
+    value = getattr(self._project, attr)
+    if attr.startswith('_') or not callable(value):
+      return value
+
+    def _traced(*args, **kws):
+      with self._trace.timing(self._name, 'git', attr):
+        return value(*args, **kws)
+
+    return _traced
+
+
+class _NoTiming(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    pass
+
+
+class _Timing(object):
+  def __init__(self, trace, name, category, item):
+    self.trace = trace
+    self.name = name
+    self.category = category
+    self.item = item
+    self.start = None
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.trace.record(
+      self.name, self.category, self.item, self.start, time.time())
+
+
+class DiffTrace(object):
+  """Collects the git calls and phase timings of the generated reports."""
+
+  FORMAT_JSON = 'json'
+  FORMAT_CHROME = 'chrome'
+
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.lock = threading.Lock()
+    self.origin = time.time()
+    self.projects = dict()
+    self.events = list()
+    self.samples = list()
+    self.listeners = list()
+
+  def _project(self, name):
+    return self.projects.setdefault(
+      name, {'git': dict(), 'phases': dict(), 'counters': dict()})
+
+  def listen(self, listener):
+    self.listeners.append(listener)
+
+  def unlisten(self, listener):
+    if listener in self.listeners:
+      self.listeners.remove(listener)
+
+  def wrap(self, name, project):
+    if (self.enabled or self.listeners) and project is not None:
+      return _TracedProject(self, name, project)
+    else:
+      return project
+
+  def timing(self, name, category, item):
+    return _Timing(self, name, category, item)
+
+  def phase(self, name, phase):
+    return _Timing(self, name, 'phases', phase)
+
+  @staticmethod
+  def git_timing(project, item):
+    """Times a git call made outside of the project, like a spooled one."""
+    if isinstance(project, _TracedProject):
+      # pylint: disable=W0212
+      return project._trace.timing(project._name, 'git', item)
+    else:
+      return _NoTiming()
+
+  def record(self, name, category, item, start, end):
+    for listener in list(self.listeners):
+      listener(name, category, item, start, end)
+
+    if not self.enabled:
+      return
+
+    with self.lock:
+      stats = self._project(name)[category].setdefault(
+        item, {'count': 0, 'time': 0.0})
+      stats['count'] += 1
+      stats['time'] += end - start
+
+      self.events.append(
+        (name, category, item, start, end, threading.current_thread().ident))
+
+  def count(self, name, counter, value=1):
+    if not self.enabled:
+      return
+
+    with self.lock:
+      counters = self._project(name)['counters']
+      counters[counter] = counters.get(counter, 0) + value
+
+  def sample(self, name, series, value):
+    """Records a value changing over the time, like a concurrency limit."""
+    if not self.enabled:
+      return
+
+    with self.lock:
+      now = time.time()
+      self._project(name).setdefault('samples', dict()).setdefault(
+        series, list()).append([now - self.origin, value])
+      self.samples.append((name, series, now, value))
+
+  def summary(self):
+    with self.lock:
+      git, phases = dict(), dict()
+      for record in self.projects.values():
+        for totals, category in ((git, 'git'), (phases, 'phases')):
+          for item, stats in record[category].items():
+            total = totals.setdefault(item, {'count': 0, 'time': 0.0})
+            total['count'] += stats['count']
+            total['time'] += stats['time']
+
+      return {'git': git, 'phases': phases}
+
+  def dump(self, filename, format=None):  # pylint: disable=W0622
+    if not self.enabled:
+      return
+
+    with self.lock:
+      if format == DiffTrace.FORMAT_CHROME:
+        threads = dict()
+        events = list()
+        for name, category, item, start, end, ident in self.events:
+          events.append({
+            'name': item, 'cat': category, 'ph': 'X',
+            'ts': int((start - self.origin) * 1000000),
+            'dur': int((end - start) * 1000000),
+            'pid': 1, 'tid': threads.setdefault(ident, len(threads) + 1),
+            'args': {'project': name}})
+
+        for name, series, now, value in self.samples:
+          events.append({
+            'name': series, 'cat': 'samples', 'ph': 'C',
+            'ts': int((now - self.origin) * 1000000), 'pid': 1,
+            'args': {series: value}})
+
+        data = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+      else:
+        data = {
+          'elapsed': time.time() - self.origin, 'projects': self.projects}
+
+    with open(filename, 'w') as fp:
+      json.dump(data, fp, indent=2, sort_keys=True)
+
+
+TOPIC_ENTRY = 'DiffTrace'
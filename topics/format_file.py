@@ -1,5 +1,7 @@
 
+import errno
 import os
+import re
 
 
 def _dict_merge(ret, dictb):
@@ -280,6 +282,10 @@ class _Mutliple(_Partical):
   def wh5(self, *args, **kws):
     return _H5(self.bundle, self, *args, **kws)
 
+  def input(self, **kws):  # pylint: disable=W0622
+    with _Input(self.bundle, self, **kws):
+      pass
+
   def nav(self, *args, **kws):
     return _Nav(self.bundle, parent=self, *args, **kws)
 
@@ -298,6 +304,16 @@ class _Mutliple(_Partical):
     with _S(self.bundle, self, *args, **kws):
       pass
 
+  class _Script(_Element):
+    def __init__(self, bundle, parent, *args, **kws):
+      _Element.__init__(
+        self, bundle, 'script', 'start', parent,
+        *args if len(args) > 0 else '', **kws)
+
+  def script(self, *args, **kws):
+    with _Mutliple._Script(self.bundle, self, *args, **kws):
+      pass
+
   def ws(self, *args, **kws):
     return _S(self.bundle, self, *args, **kws)
 
@@ -338,6 +354,11 @@ class _H5(_Mutliple):
     _Mutliple.__init__(self, bundle, 'h5', 'start', parent, *args, **kws)
 
 
+class _Input(_Element):
+  def __init__(self, bundle, parent=None, **kws):
+    _Element.__init__(self, bundle, 'input', 'start', parent, **kws)
+
+
 class _Nav(_Mutliple):
   def __init__(self, bundle, *args, **kws):
     _Mutliple.__init__(self, bundle, 'nav', *args, **kws)
@@ -407,30 +428,81 @@ class _Body(_Mutliple):
   def __init__(self, bundle, **kws):
     _Mutliple.__init__(self, bundle, 'body', **kws)
 
-  class _Script(_Element):
-    def __init__(self, bundle, parent, *args, **kws):
-      _Element.__init__(
-        self, bundle, 'script', 'start', parent,
-        *args if len(args) > 0 else '', **kws)
 
-  def script(self, *args, **kws):
-    with _Body._Script(self.bundle, self, *args, **kws):
-      pass
+class AtomicFile(object):
+  """Writes a file through a temporary one which replaces it once closed."""
+
+  # the temporary file is named by the process and the object not to be
+  # shared by the writers of the same file
+  TMP_MATCHER = re.compile(r'^\..+\.(\d+)\.[0-9a-f]+\.tmp$')
+
+  def __init__(self, filename, mode='w'):
+    self.filename = filename
+    self.tmpname = os.path.join(
+      os.path.dirname(filename), '.%s.%d.%x.tmp' % (
+        os.path.basename(filename), os.getpid(), id(self)))
+    self.fp = open(self.tmpname, mode)
+
+  def __enter__(self):
+    return self.fp
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self.discard()
+
+  def close(self):
+    self.fp.close()
+    # os.replace overrides the existing file on Windows either
+    getattr(os, 'replace', os.rename)(self.tmpname, self.filename)
+
+  def discard(self):
+    self.fp.close()
+    os.unlink(self.tmpname)
+
+  @staticmethod
+  def cleanup(directory):
+    # the process can't be probed without being terminated on Windows
+    if os.name == 'nt' or not os.path.isdir(directory):
+      return
+
+    for name in os.listdir(directory):
+      match = AtomicFile.TMP_MATCHER.match(name)
+      if not match or int(match.group(1)) == os.getpid():
+        continue
+
+      try:
+        os.kill(int(match.group(1)), 0)
+      except OSError as e:
+        # the file of a killed writer is left behind
+        if e.errno == errno.ESRCH:
+          try:
+            os.unlink(os.path.join(directory, name))
+          except OSError:
+            pass
 
 
 class FormattedFile(_Element):
   def __init__(self, name, format=None):  # pylint: disable=W0622
     fname, _ = os.path.splitext(name)
-    self.fp = open('%s.html' % fname, 'w')
+    self.filename = '%s.html' % fname
+    # publish the page when completed to keep the readers from the
+    # half-written file
+    self.file = AtomicFile(self.filename)
+    self.fp = self.file.fp
 
     _Element.__init__(self, self.fp, 'html')
 
   def __exit__(self, exc_type, exc_value, traceback):
-    self.close()
+    if exc_type is None:
+      self.close()
+    else:
+      self.file.discard()
 
   def close(self):
     self.update(action='end')
-    self.fp.close()
+    self.file.close()
 
   def head(self):
     return _Head(self.fp, parent=self)
@@ -443,4 +515,4 @@ class FormattedFile(_Element):
     return FormattedFile(name, format)
 
 
-TOPIC_ENTRY = 'FormattedFile'
+TOPIC_ENTRY = 'AtomicFile, FormattedFile'